@@ -0,0 +1,103 @@
+"""Benchmark of switching between saved chats: reopening them as app.py does versus re-mapping every message.
+
+Fills a chat store with archived chats, saved as app.py saves them, then opens them in turn
+each way and starts a Gemini session from the history their next message would send, e.g.
+
+    python benchmarks/archive.py --chats 50 --messages 200
+"""
+
+import argparse
+import os
+import time
+import uuid
+
+from common import fake_app_env, ms, percentiles, write_report
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=50, help="archived chats")
+    parser.add_argument("--messages", type=int, default=200, help="messages per chat")
+    parser.add_argument("--switches", type=int, default=500, help="chat switches to time per way")
+    parser.add_argument("--reply-chars", type=int, default=600, help="characters per reply")
+    parser.add_argument("--output", help="JSON file to write; defaults to benchmarks/results/archive-<time>.json")
+    return parser.parse_args()
+
+def fill_store(store, args):
+    from chat_engine import Conversation
+
+    owner = uuid.uuid4().hex
+    reply = ("Here is a detailed answer. " * (args.reply_chars // 27 + 1))[:args.reply_chars]
+    recent = {}
+    for i in range(args.chats):
+        chat_id = store.create_chat(owner, f"Chat {i}...")
+        conversation = Conversation()
+        for seq in range(args.messages):
+            role = "user" if seq % 2 == 0 else "assistant"
+            content = f"Question {seq} of chat {i}: how do I get better at interviews?" if role == "user" else reply
+            conversation.add_message(role, content, "en")
+            store.append_message(chat_id, seq, role, content)
+        # As save_chat_context and remember_chat do when the chat is left
+        store.save_context(chat_id, {"context_window": conversation.context})
+        recent[chat_id] = conversation
+    return recent
+
+def time_switches(args, chat_ids, open_chat):
+    seconds = []
+    for n in range(args.switches):
+        chat_id = chat_ids[n % len(chat_ids)]
+        started_at = time.perf_counter()
+        open_chat(chat_id)
+        seconds.append(time.perf_counter() - started_at)
+    return {"switch_ms": percentiles(ms(seconds)), "switches_per_second": len(seconds) / sum(seconds)}
+
+def main():
+    args = parse_args()
+    workdir = fake_app_env()
+
+    from fake_gemini import FakeBackend, install
+    install(FakeBackend())
+
+    from chat_engine import ChatEngine, ChatStore, Conversation
+
+    engine = ChatEngine()
+    store = ChatStore(os.path.join(workdir, "archive.db"))
+    started_at = time.perf_counter()
+    recent = fill_store(store, args)
+    print(f"Saved {args.chats} chats of {args.messages} messages in {time.perf_counter() - started_at:.1f} s")
+    chat_ids = list(recent)
+
+    def start_session(conversation):
+        # What the next message's call starts from: the trimmed history, read from the messages
+        return engine.model("en").start_chat(history=conversation.history())
+
+    def from_memory(chat_id):
+        # A recently open chat: the conversation is reused as it is
+        start_session(recent[chat_id])
+
+    def from_store(chat_id):
+        # As open_chat does for a chat that is not in memory; the saved summary is not rebuilt
+        stored = store.load_context(chat_id)
+        start_session(Conversation(store.load_messages(chat_id), stored["context_window"]))
+
+    def without_context(chat_id):
+        # Messages only: the summary of the older messages is built again from them
+        start_session(Conversation(store.load_messages(chat_id)))
+
+    def remapped(chat_id):
+        # How chats were restored before: every message mapped into a new history
+        messages = store.load_messages(chat_id)
+        history = [{"role": "model" if m.role == "assistant" else "user", "parts": [m.content]} for m in messages]
+        engine.model("en").start_chat(history=history)
+
+    ways = {"from_memory": from_memory, "from_store": from_store, "without_context": without_context, "remapped": remapped}
+    results = {}
+    for name, open_chat in ways.items():
+        open_chat(chat_ids[0])  # Builds the model once
+        results[name] = time_switches(args, chat_ids, open_chat)
+        switch_ms = results[name]["switch_ms"]
+        print(f"{name:>15}  switch p50 {switch_ms['p50']:.3f} ms  p95 {switch_ms['p95']:.3f} ms")
+
+    write_report("archive", {key: value for key, value in vars(args).items() if key != "output"}, results, args.output)
+
+if __name__ == "__main__":
+    main()
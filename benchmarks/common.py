@@ -0,0 +1,71 @@
+"""Helpers shared by the benchmark scripts: percentiles, the fake-backend app setup and reports."""
+
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import warnings
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARK_DIR)
+APP_PATH = os.path.join(ROOT, "app.py")
+sys.path.insert(0, ROOT)
+
+# google.generativeai warns on import that it is deprecated
+warnings.filterwarnings("ignore", message=r"(?s).*google\.generativeai", category=FutureWarning)
+
+def percentiles(values):
+    values = list(values)
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def at(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": ordered[-1], "mean": sum(ordered) / len(ordered)}
+
+def ms(seconds):
+    return [s * 1000 for s in seconds if s is not None]
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin" else 1)
+
+def fake_app_env(**extra):
+    """Environment for running app.py offline: a fake key, a scratch chat store and no rate limit.
+
+    Must be called before chat_engine is imported, since the limiter reads it at import.
+    """
+    workdir = tempfile.mkdtemp(prefix="bot-benchmark-")
+    os.environ.update({
+        "GEMINI_API_KEY": "fake-benchmark-key",
+        "CHAT_DB_PATH": os.path.join(workdir, "chat_history.db"),
+        # The fake has no quota, so the limiter should never be what is measured
+        "GEMINI_RATE_PER_MINUTE": "1000000",
+        "GEMINI_BURST": "1000000",
+        "GEMINI_MAX_CONCURRENT": "1000",
+        **extra,
+    })
+    return workdir
+
+def write_report(name, config, results, output=None, **extra):
+    """Write the results as JSON to output, by default benchmarks/results/<name>-<time>.json."""
+    report = {
+        "benchmark": name,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "config": config,
+        **extra,
+        "peak_rss_kb": peak_rss_kb(),
+        "results": results,
+    }
+    output = output or os.path.join(BENCHMARK_DIR, "results", f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {output}")
+    return output
@@ -0,0 +1,145 @@
+"""Local stand-in for the Gemini API, so the app can be benchmarked offline without an API key.
+
+Only the model's generate_content call is faked. Chats are the SDK's own ChatSession, so history
+handling and broken streams behave as they do against the real API.
+"""
+
+import random
+import threading
+import time
+from collections import deque
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from google.generativeai import protos
+from google.generativeai.types import generation_types
+
+# Errors the fake can raise, by the name used on the command line
+FAKE_ERRORS = {
+    "429": google_exceptions.TooManyRequests,
+    "500": google_exceptions.InternalServerError,
+    "503": google_exceptions.ServiceUnavailable,
+    "400": google_exceptions.InvalidArgument,
+}
+
+class FakeBackend:
+    """Latency, reply shape and error injection shared by every fake model and chat.
+
+    error_rate is the share of calls that fail before any chunk is sent; stream_error_rate is
+    the share of streamed replies that fail after their first chunk. With a quota, calls over
+    quota_per_second or quota_concurrent get a 429, as the real API does.
+    """
+
+    def __init__(self, first_chunk_latency=0.05, chunk_delay=0.01, chunks=8, error_rate=0.0, error="503",
+                 seed=0, stream_error_rate=0.0, quota_per_second=None, quota_concurrent=None):
+        self.first_chunk_latency = first_chunk_latency
+        self.chunk_delay = chunk_delay
+        self.chunks = chunks
+        self.error_rate = error_rate
+        self.stream_error_rate = stream_error_rate
+        self.error = FAKE_ERRORS[error]
+        self.quota_per_second = quota_per_second
+        self.quota_concurrent = quota_concurrent
+        self.calls = 0
+        self.errors = 0
+        self.broken_streams = 0
+        self.rejected = 0  # 429s for going over the quota
+        self.in_flight = 0
+        self.on_chunk = None  # Called with the index of each streamed chunk before it is sent
+        self._recent_calls = deque()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def maybe_fail(self):
+        with self._lock:
+            self.calls += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if failed:
+            raise self.error("Injected by the fake Gemini backend")
+
+    def start_call(self):
+        # Admits a call within the quota; every admitted call must be ended with end_call()
+        with self._lock:
+            now = time.monotonic()
+            while self._recent_calls and now - self._recent_calls[0] > 1:
+                self._recent_calls.popleft()
+            over_rate = self.quota_per_second is not None and len(self._recent_calls) >= self.quota_per_second
+            over_concurrency = self.quota_concurrent is not None and self.in_flight >= self.quota_concurrent
+            if over_rate or over_concurrency:
+                self.rejected += 1
+                raise google_exceptions.TooManyRequests("Quota exceeded in the fake Gemini backend")
+            self._recent_calls.append(now)
+            self.in_flight += 1
+
+    def end_call(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def breaks_stream(self):
+        with self._lock:
+            broken = self._random.random() < self.stream_error_rate
+            if broken:
+                self.broken_streams += 1
+        return broken
+
+    def reply_words(self, prompt):
+        words = f"This is a fake reply to: {prompt}".split()
+        return [words[i % len(words)] + " " for i in range(self.chunks)]
+
+def response_chunk(text, prompt_tokens, reply_tokens, finished=False):
+    candidate = protos.Candidate(content=protos.Content(role="model", parts=[protos.Part(text=text)]), index=0)
+    if finished:
+        candidate.finish_reason = protos.Candidate.FinishReason.STOP
+    usage = protos.GenerateContentResponse.UsageMetadata(
+        prompt_token_count=prompt_tokens, candidates_token_count=reply_tokens
+    )
+    return protos.GenerateContentResponse(candidates=[candidate], usage_metadata=usage)
+
+def install(backend):
+    """Replace genai.GenerativeModel and genai.configure with fakes backed by backend."""
+
+    class FakeGenerativeModel(genai.GenerativeModel):
+        def generate_content(self, contents, *, stream=False, request_options=None, **kwargs):
+            backend.start_call()
+            streaming = False  # Once the stream starts, it ends the call itself
+            try:
+                backend.maybe_fail()
+                prompt = contents[-1].parts[0].text
+                words = backend.reply_words(prompt)
+                sent = sum(len(part.text) for content in contents for part in content.parts)
+                if self._system_instruction is not None:
+                    sent += sum(len(part.text) for part in self._system_instruction.parts)
+                prompt_tokens = sent // 4 + 1
+
+                if not stream:
+                    # A blocking call returns only once the whole reply is ready
+                    time.sleep(backend.first_chunk_latency + backend.chunk_delay * (len(words) - 1))
+                    reply = response_chunk("".join(words), prompt_tokens, len(words), finished=True)
+                    return generation_types.GenerateContentResponse.from_response(reply)
+
+                broken = backend.breaks_stream()
+
+                def chunks():
+                    try:
+                        time.sleep(backend.first_chunk_latency)
+                        for i, word in enumerate(words):
+                            if i:
+                                time.sleep(backend.chunk_delay)
+                                if broken:
+                                    raise backend.error("Stream broken by the fake Gemini backend")
+                            if backend.on_chunk is not None:
+                                backend.on_chunk(i)
+                            yield response_chunk(word, prompt_tokens, i + 1, finished=i == len(words) - 1)
+                    finally:
+                        backend.end_call()
+
+                streaming = True
+                return generation_types.GenerateContentResponse.from_iterator(chunks())
+            finally:
+                if not streaming:
+                    backend.end_call()
+
+    genai.GenerativeModel = FakeGenerativeModel
+    genai.configure = lambda **kwargs: None
@@ -0,0 +1,133 @@
+"""Throughput benchmark of language detection over a mixed corpus of English, Roman Urdu and Roman Sindhi.
+
+Times the keyword and phrase matching on its own, the old substring scans next to the token
+lookups, and then ChatEngine.detect_language as a whole with a cold and a warm cache, e.g.
+
+    python benchmarks/language.py --messages 5000
+"""
+
+import argparse
+import random
+import time
+from collections import Counter
+
+from common import fake_app_env, write_report
+
+# Message templates per language; a number is added to each so every message is different
+CORPUS = {
+    "en": [
+        "Can you help me prepare for a job interview at a software company?",
+        "What skills should I learn to become a data scientist next year?",
+        "How do I write a good cover letter when I have no experience?",
+        "Give me three tips to avoid burnout when working from home.",
+        "Please explain how a hash table works with a short example.",
+    ],
+    "roman_ur": [
+        "mujhe job interview ki tayari mein madad chahiye",
+        "data scientist banne ke liye kya seekhna chahiye mujhe",
+        "software job ke liye acha cover letter kaise likhun",
+        "kaam mein thakawat se bachne ke teen tareeqe batao",
+        "ap kese ho aaj kal kya kar rahe ho",
+    ],
+    "roman_sd": [
+        "cha hal aahe, mokhe nokri jo interview aahe",
+        "keean aahiyan, mokhe data scientist thiyan aahe",
+        "mehrbani kare mokhe cover letter likhan mein madad kario",
+        "kam khaan thakawat khaan bachan ja tre tareeqa budhao",
+        "tu keean ahes, achho aahe sab kuch",
+    ],
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000, help="messages in the corpus")
+    parser.add_argument("--repeated", type=int, default=500, help="distinct messages in the warm-cache run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file to write; defaults to benchmarks/results/language-<time>.json")
+    return parser.parse_args()
+
+def build_corpus(count, seed):
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        language = rng.choice(list(CORPUS))
+        corpus.append((language, f"{rng.choice(CORPUS[language])} {i}"))
+    return corpus
+
+def substring_scan(text, urdu_phrases, sindhi_phrases, urdu_keywords, sindhi_keywords):
+    # The matching detect_language did before token lookups: a substring scan per phrase and keyword
+    lower_text = text.lower()
+    if any(phrase in lower_text for phrase in urdu_phrases):
+        return "roman_ur"
+    if any(phrase in lower_text for phrase in sindhi_phrases):
+        return "roman_sd"
+    short_message = len(text.split()) <= 5
+    sindhi_matches = sum(1 for word in sindhi_keywords if word in lower_text)
+    if sindhi_matches >= 2 or (sindhi_matches == 1 and short_message):
+        return "roman_sd"
+    urdu_matches = sum(1 for word in urdu_keywords if word in lower_text)
+    if urdu_matches >= 2 or (urdu_matches == 1 and short_message):
+        return "roman_ur"
+    return None
+
+def throughput(corpus, detect):
+    detect(corpus[0][1])  # Loads anything loaded on first use
+    started_at = time.perf_counter()
+    detected = [detect(text) for _, text in corpus]
+    seconds = time.perf_counter() - started_at
+    # Matching alone answers None for anything that is not Roman Urdu or Sindhi
+    correct = sum((found or "en") == language for (language, _), found in zip(corpus, detected))
+    return {
+        "messages_per_second": len(corpus) / seconds,
+        "us_per_message": seconds / len(corpus) * 1e6,
+        "accuracy": correct / len(corpus),
+        "detected": {str(language): n for language, n in Counter(detected).most_common()},
+    }
+
+def main():
+    args = parse_args()
+    fake_app_env()
+
+    import chat_engine
+    from chat_engine import ChatEngine, Conversation, RomanLanguageDetector
+
+    corpus = build_corpus(args.messages, args.seed)
+    lists = (
+        chat_engine.urdu_test_phrases, chat_engine.sindhi_test_phrases,
+        chat_engine.roman_urdu_keywords, chat_engine.roman_sindhi_keywords,
+    )
+    detector = RomanLanguageDetector(*lists)
+
+    def token_lookup(text):
+        tokens = detector.tokenize(text)
+        return detector.match_phrases(tokens) or detector.match_keywords(tokens, short_message=len(tokens) <= 5)
+
+    engine = ChatEngine()
+    chat_engine.langdetect_warmup["ready"].wait()
+    conversation = Conversation()
+
+    def detect_language(text):
+        return engine.detect_language(conversation, text)
+
+    results = {
+        "substring_scan": throughput(corpus, lambda text: substring_scan(text, *lists)),
+        "token_lookup": throughput(corpus, token_lookup),
+        # Every message is new, so nothing comes from the cache
+        "detect_language_cold": throughput(corpus, detect_language),
+        # A few hundred messages asked again and again, as common greetings and questions are
+        "detect_language_warm": throughput(corpus[:args.repeated] * (len(corpus) // args.repeated), detect_language),
+    }
+    results["detect_language_warm"]["cache"] = engine.detector.stats()
+    for name, result in results.items():
+        print(
+            f"{name:>22}  {result['messages_per_second']:10.0f} messages/s  {result['us_per_message']:8.1f} us/message  "
+            f"accuracy {result['accuracy']:.1%}"
+        )
+    # Loaded in the background when the engine starts, so none of the runs above includes it
+    results["langdetect_load_seconds"] = chat_engine.langdetect_warmup["load_seconds"]
+    print(f"langdetect profiles loaded in {results['langdetect_load_seconds']:.2f} s")
+
+    write_report("language", {key: value for key, value in vars(args).items() if key != "output"}, results, args.output)
+
+if __name__ == "__main__":
+    main()
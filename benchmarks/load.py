@@ -0,0 +1,111 @@
+"""Load test of the rate limiter: many callers at once against a rate-limited fake backend.
+
+The backend answers 429 to calls over its quota, as Gemini does. Each run is made twice, without
+the limiter (every caller goes straight to the backend) and with it, e.g.
+
+    python benchmarks/load.py --callers 60 --quota-per-second 10 --quota-concurrent 4
+"""
+
+import argparse
+import threading
+import time
+from collections import Counter
+
+from common import fake_app_env, ms, percentiles, write_report
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--callers", type=int, default=60, help="sessions sending a message at the same time")
+    parser.add_argument("--quota-per-second", type=int, default=10, help="backend calls allowed per second")
+    parser.add_argument("--quota-concurrent", type=int, default=4, help="backend calls allowed at once")
+    parser.add_argument("--burst", type=int, default=5, help="calls the limiter lets through at once after a quiet spell")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds until the first chunk")
+    parser.add_argument("--timeout", type=float, default=60.0, help="deadline per reply, in seconds")
+    parser.add_argument("--output", help="JSON file to write; defaults to benchmarks/results/load-<time>.json")
+    return parser.parse_args()
+
+def run_callers(args, backend, gate):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from chat_engine import ChatEngine, Conversation
+
+    engine = ChatEngine(gate=gate, executor=ThreadPoolExecutor(max_workers=args.callers), timeout=args.timeout)
+    outcomes = Counter()
+    seconds = []
+    retries = []
+    line_positions = []
+    lock = threading.Lock()
+
+    def caller(i):
+        conversation = Conversation()
+
+        def on_wait(status):
+            if "number" in status:
+                with lock:
+                    line_positions.append(int(status.split("number ")[1].split()[0]))
+
+        turn = None
+        started_at = time.perf_counter()
+        try:
+            # Each prompt is different, so no two callers can share a call
+            turn = engine.begin_turn(conversation, f"Can you help me prepare for job interview number {i}?")
+            for _ in engine.stream_turn(conversation, turn, on_wait=on_wait):
+                pass
+            outcome = "ok"
+        except Exception as e:
+            outcome = type(e).__name__
+        with lock:
+            outcomes[outcome] += 1
+            seconds.append(time.perf_counter() - started_at)
+            retries.append(turn.metrics.get("retries", 0) if turn is not None else 0)
+
+    calls_before, rejected_before = backend.calls, backend.rejected
+    started_at = time.perf_counter()
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(args.callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        "outcomes": dict(outcomes),
+        "backend_calls": backend.calls - calls_before,
+        "backend_429s": backend.rejected - rejected_before,
+        "retries": sum(retries),
+        "max_line_position": max(line_positions, default=0),
+        "reply_ms": percentiles(ms(seconds)),
+        "wall_seconds": time.perf_counter() - started_at,
+    }
+
+def main():
+    args = parse_args()
+    fake_app_env()
+
+    from fake_gemini import FakeBackend, install
+    from chat_engine import GeminiGate
+
+    backend = FakeBackend(
+        first_chunk_latency=args.latency, chunk_delay=0.0, chunks=1,
+        quota_per_second=args.quota_per_second, quota_concurrent=args.quota_concurrent,
+    )
+    install(backend)
+
+    gates = {
+        # Limits so high that every caller goes straight to the backend
+        "ungated": GeminiGate(1_000_000_000, 1_000_000_000, 1_000_000_000),
+        # The limiter set to the backend's quota
+        "gated": GeminiGate(args.quota_per_second * 60, args.burst, args.quota_concurrent),
+    }
+    results = {}
+    for name, gate in gates.items():
+        results[name] = run_callers(args, backend, gate)
+        time.sleep(1)  # Let the backend's quota window clear between runs
+        result = results[name]
+        print(
+            f"{name:>8}  {result['outcomes']}  backend 429s {result['backend_429s']}  retries {result['retries']}  "
+            f"max line position {result['max_line_position']}  wall {result['wall_seconds']:.1f} s"
+        )
+
+    write_report("load", {key: value for key, value in vars(args).items() if key != "output"}, results, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Memory benchmark of a long chat: messages as dicts versus Message objects, and the turn history.
+
+Measured with tracemalloc, so only Python allocations are counted, e.g.
+
+    python benchmarks/memory.py --messages 10000
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from common import fake_app_env, write_report
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=10000, help="messages in the chat")
+    parser.add_argument("--reply-chars", type=int, default=600, help="characters per reply")
+    parser.add_argument("--output", help="JSON file to write; defaults to benchmarks/results/memory-<time>.json")
+    return parser.parse_args()
+
+def allocated(build):
+    """Bytes still allocated by build()'s result, and the peak while it ran."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current - before, peak - before
+
+def main():
+    args = parse_args()
+    fake_app_env()
+
+    from chat_engine import Conversation, Message, build_context_history
+
+    reply = ("Here is a detailed answer. " * (args.reply_chars // 27 + 1))[:args.reply_chars]
+    # The texts are made first and shared, so only what each message adds on top is counted
+    texts = [
+        (
+            "user" if i % 2 == 0 else "assistant",
+            f"Can you help me prepare for job interview number {i}?" if i % 2 == 0 else f"{reply} {i}",
+        )
+        for i in range(args.messages)
+    ]
+    text_bytes = sum(len(content.encode("utf-8")) for _, content in texts)
+    now = time.time()
+
+    dicts, dict_bytes, _ = allocated(lambda: [{"role": role, "content": content} for role, content in texts])
+    messages, message_bytes, _ = allocated(lambda: [Message(role, content, now, "en") for role, content in texts])
+
+    # The whole chat as Gemini history: a parallel list of dicts, as before, or a view over the messages
+    _, history_list_bytes, _ = allocated(lambda: [m.to_gemini() for m in messages])
+    conversation = Conversation(messages)
+    _, history_view_bytes, _ = allocated(conversation.history)
+
+    # What one turn allocates to assemble its history, with and without a copy of the message list
+    _, _, turn_copy_peak = allocated(lambda: build_context_history(messages[:-1], conversation.context))
+    _, _, turn_view_peak = allocated(lambda: build_context_history(messages, conversation.context, end=len(messages) - 1))
+
+    results = {
+        "text_bytes": text_bytes,
+        "messages": {
+            "dict_bytes": dict_bytes,
+            "message_bytes": message_bytes,
+            "dict_bytes_per_message": dict_bytes / args.messages,
+            "message_bytes_per_message": message_bytes / args.messages,
+        },
+        "history": {"list_bytes": history_list_bytes, "view_bytes": history_view_bytes},
+        "turn_assembly_peak": {"copied_list_bytes": turn_copy_peak, "view_bytes": turn_view_peak},
+    }
+    print(f"{args.messages} messages, {text_bytes / 1024:.0f} KiB of text, not counted below")
+    print(
+        f"  messages  dicts {dict_bytes / 1024:7.0f} KiB ({dict_bytes / args.messages:.0f} B each)  "
+        f"Message {message_bytes / 1024:7.0f} KiB ({message_bytes / args.messages:.0f} B each)"
+    )
+    print(f"  history   list {history_list_bytes / 1024:7.0f} KiB  view {history_view_bytes / 1024:7.1f} KiB")
+    print(f"  one turn  copied list peak {turn_copy_peak / 1024:7.1f} KiB  view peak {turn_view_peak / 1024:7.1f} KiB")
+
+    write_report("memory", {key: value for key, value in vars(args).items() if key != "output"}, results, args.output)
+
+if __name__ == "__main__":
+    main()
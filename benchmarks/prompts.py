@@ -0,0 +1,98 @@
+"""Microbenchmark of prompt assembly: the system instruction and the trimmed history of a turn.
+
+Compares building the prompt templates on every message, as the prompt handler used to, with
+the registry rendered once per process, and times begin_turn's assembly as the chat grows, e.g.
+
+    python benchmarks/prompts.py --lengths 10 100 1000
+"""
+
+import argparse
+import inspect
+import timeit
+
+from common import fake_app_env, write_report
+
+LANGUAGES = ["en", "ur", "sd", "roman_ur", "roman_sd"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 100, 1000], help="messages in the chat")
+    parser.add_argument("--number", type=int, default=2000, help="calls per timing")
+    parser.add_argument("--repeat", type=int, default=5, help="timings, of which the best is kept")
+    parser.add_argument("--output", help="JSON file to write; defaults to benchmarks/results/prompts-<time>.json")
+    return parser.parse_args()
+
+def best_us(call, args):
+    return min(timeit.repeat(call, number=args.number, repeat=args.repeat)) / args.number * 1e6
+
+def templates_code():
+    # The template dicts as the prompt handler built them on every message, from their source
+    import chat_engine
+
+    source = inspect.getsource(chat_engine)
+    start = source.index("# ---------- Prompt Templates ----------")
+    end = source.index("def render_system_instruction")
+    return compile(source[start:end], "prompt_templates", "exec")
+
+def main():
+    args = parse_args()
+    fake_app_env()
+
+    from chat_engine import (
+        Conversation, build_context_history, build_system_instruction, estimate_tokens, load_prompt_registry,
+        render_system_instruction,
+    )
+
+    code = templates_code()
+
+    def rebuilt(language):
+        templates = {}
+        exec(code, templates)
+        instruction = templates["system_instruction"].get(language, templates["system_instruction"]["en"])
+        return render_system_instruction(instruction, language)
+
+    registry = load_prompt_registry()
+    results = {
+        "instruction_us": {
+            language: {
+                "rebuilt_per_message": best_us(lambda: rebuilt(language), args),
+                "registry_lookup": best_us(lambda: build_system_instruction(registry, language), args),
+            }
+            for language in LANGUAGES
+        },
+        "load_prompt_registry_us": best_us(load_prompt_registry, args),
+        "assembly_us": {},
+    }
+    for language, timings in results["instruction_us"].items():
+        print(
+            f"{language:>9}  rebuilt {timings['rebuilt_per_message']:7.2f} us  "
+            f"registry {timings['registry_lookup']:5.2f} us"
+        )
+    print(f"load_prompt_registry, once per process: {results['load_prompt_registry_us']:.2f} us")
+
+    reply = "Here is a detailed answer. " * 20
+    prompt = "Can you help me prepare for a job interview?"
+    for length in args.lengths:
+        conversation = Conversation()
+        for i in range(length):
+            conversation.add_message("user" if i % 2 == 0 else "assistant", prompt if i % 2 == 0 else reply, "en")
+        conversation.add_message("user", prompt, "en")
+
+        def assemble():
+            # What begin_turn does under its prompt_assembly span
+            instruction = build_system_instruction(registry, "en")
+            history, _ = build_context_history(
+                conversation.messages,
+                conversation.context,
+                reserved_tokens=estimate_tokens(instruction) + estimate_tokens(prompt),
+                end=len(conversation.messages) - 1,
+            )
+            return list(history)
+
+        results["assembly_us"][length] = best_us(assemble, args)
+        print(f"{length:>5} messages  prompt assembly {results['assembly_us'][length]:8.1f} us")
+
+    write_report("prompts", {key: value for key, value in vars(args).items() if key != "output"}, results, args.output)
+
+if __name__ == "__main__":
+    main()
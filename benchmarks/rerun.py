@@ -0,0 +1,73 @@
+"""Benchmark of app.py's rerun time against the length of the open chat.
+
+Each chat is put into session state before the first run, then the script is rerun with the
+transcript paged, as the app draws it, and with every message drawn, as it used to, e.g.
+
+    python benchmarks/rerun.py --messages 100 1000 5000
+"""
+
+import argparse
+import time
+
+from common import APP_PATH, fake_app_env, ms, percentiles, write_report
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, nargs="+", default=[100, 1000, 5000], help="messages in the open chat")
+    parser.add_argument("--reruns", type=int, default=10, help="reruns to time per chat")
+    parser.add_argument("--reply-chars", type=int, default=600, help="characters per reply")
+    parser.add_argument("--output", help="JSON file to write; defaults to benchmarks/results/rerun-<time>.json")
+    return parser.parse_args()
+
+def filled_conversation(length, reply_chars):
+    from chat_engine import Conversation
+
+    reply = ("Here is a **detailed** answer with a [link](https://example.com). " * (reply_chars // 64 + 1))[:reply_chars]
+    conversation = Conversation()
+    for i in range(length):
+        if i % 2 == 0:
+            conversation.add_message("user", f"Can you help me prepare for job interview number {i}?", "en")
+        else:
+            conversation.add_message("assistant", reply, "en")
+    return conversation
+
+def time_reruns(length, args, full):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=300)
+    at.session_state.conversation = filled_conversation(length, args.reply_chars)
+    at.session_state.show_welcome = False
+    if full:
+        at.session_state.transcript_window = length
+    at.run()
+    if at.exception:
+        raise RuntimeError(f"app raised: {at.exception}")
+
+    seconds = []
+    for _ in range(args.reruns):
+        started_at = time.perf_counter()
+        at.run()
+        seconds.append(time.perf_counter() - started_at)
+    return {"rerun_ms": percentiles(ms(seconds)), "drawn_messages": len(at.chat_message)}
+
+def main():
+    args = parse_args()
+    fake_app_env(SESSION_MEMORY_BUDGET=str(1024 ** 3))
+
+    from fake_gemini import FakeBackend, install
+    install(FakeBackend())
+
+    results = []
+    for length in args.messages:
+        result = {"messages": length, "paged": time_reruns(length, args, full=False), "full": time_reruns(length, args, full=True)}
+        results.append(result)
+        print(
+            f"{length:>5} messages  paged rerun p50 {result['paged']['rerun_ms']['p50']:7.1f} ms "
+            f"({result['paged']['drawn_messages']} drawn)  "
+            f"full rerun p50 {result['full']['rerun_ms']['p50']:7.1f} ms ({result['full']['drawn_messages']} drawn)"
+        )
+
+    write_report("rerun", {key: value for key, value in vars(args).items() if key != "output"}, results, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Offline end-to-end benchmark of app.py against a fake Gemini backend.
+
+Drives the app through Streamlit's AppTest harness for each language and conversation length
+and writes the results as JSON, e.g.
+
+    python benchmarks/run.py --turns 5 20 50 --languages en roman_ur --error-rate 0.05
+"""
+
+import argparse
+import time
+
+from common import APP_PATH, fake_app_env, ms, percentiles, write_report
+
+# Sample prompts per language; they are cycled through for longer conversations
+PROMPTS = {
+    "en": [
+        "Can you help me prepare for a job interview?",
+        "What skills should I learn to become a data scientist?",
+        "How do I write a good cover letter for a software job?",
+        "Give me three tips to avoid burnout at work.",
+    ],
+    "roman_ur": [
+        "mujhe job interview ki tayari mein madad chahiye",
+        "data scientist banne ke liye kya seekhna chahiye",
+        "software job ke liye acha cover letter kaise likhun",
+        "kaam mein thakawat se bachne ke teen tareeqe batao",
+    ],
+    "ur": [
+        "مجھے نوکری کے انٹرویو کی تیاری میں مدد چاہیے",
+        "ڈیٹا سائنٹسٹ بننے کے لیے مجھے کیا سیکھنا چاہیے؟",
+        "سافٹ ویئر کی نوکری کے لیے اچھا کور لیٹر کیسے لکھوں؟",
+        "کام کی تھکاوٹ سے بچنے کے تین طریقے بتائیں",
+    ],
+    "sd": [
+        "مون کي نوڪري جي انٽرويو جي تياري ۾ مدد گهرجي",
+        "ڊيٽا سائنٽسٽ ٿيڻ لاءِ مون کي ڇا سکڻ گهرجي؟",
+        "سافٽ ويئر جي نوڪري لاءِ سٺو ڪور ليٽر ڪيئن لکان؟",
+        "ڪم جي ٿڪاوٽ کان بچڻ جا ٽي طريقا ٻڌايو",
+    ],
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, nargs="+", default=[5, 20, 50], help="conversation lengths to run")
+    parser.add_argument("--languages", nargs="+", default=list(PROMPTS), choices=list(PROMPTS))
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds until the first chunk")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="seconds between chunks")
+    parser.add_argument("--chunks", type=int, default=8, help="chunks per reply")
+    parser.add_argument("--no-stream", action="store_true", help="use blocking calls instead of streaming")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls that fail")
+    parser.add_argument("--stream-error-rate", type=float, default=0.0, help="share of streamed replies that fail after their first chunk")
+    parser.add_argument("--error", default="503", help="error to inject: 429, 500, 503 or 400")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file to write; defaults to benchmarks/results/run-<time>.json")
+    return parser.parse_args()
+
+def run_conversation(language, turns, stream):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.session_state.stream_responses = stream
+    at.run()
+    turn_seconds = []
+    for i in range(turns):
+        prompts = PROMPTS[language]
+        prompt = prompts[i % len(prompts)] + ("" if i < len(prompts) else f" ({i + 1})")
+        started_at = time.perf_counter()
+        at.chat_input[0].set_value(prompt).run()
+        turn_seconds.append(time.perf_counter() - started_at)
+        if at.exception:
+            raise RuntimeError(f"app raised: {at.exception}")
+
+    # A plain rerun of the whole script with the conversation at its full length
+    rerun_seconds = []
+    for _ in range(5):
+        started_at = time.perf_counter()
+        at.run()
+        rerun_seconds.append(time.perf_counter() - started_at)
+
+    metrics = at.session_state.turn_metrics
+    messages = at.session_state.conversation.messages
+    return {
+        "language": language,
+        "turns": turns,
+        "rerun_ms": percentiles(ms(rerun_seconds)),
+        "turn_ms": percentiles(ms(turn_seconds)),
+        "first_token_ms": percentiles(ms(m["first_chunk"] for m in metrics)),
+        "reply_ms": percentiles(ms(m["total"] for m in metrics)),
+        "detected_languages": sorted({m.language for m in messages if m.role == "user" and m.language}),
+        "error_replies": sum(1 for m in messages if m.role == "assistant" and m.content.startswith("⚠️")),
+        "session_bytes": at.session_state.messages_bytes,
+        "context_tokens": metrics[-1]["context_tokens"] if metrics else None,
+    }
+
+def main():
+    args = parse_args()
+    fake_app_env()
+
+    from fake_gemini import FakeBackend, install
+    backend = FakeBackend(
+        args.latency, args.chunk_delay, args.chunks, args.error_rate, args.error, args.seed, args.stream_error_rate
+    )
+    install(backend)
+
+    results = []
+    for language in args.languages:
+        for turns in args.turns:
+            result = run_conversation(language, turns, not args.no_stream)
+            results.append(result)
+            print(
+                f"{language:>8} {turns:>4} turns  rerun p50 {result['rerun_ms']['p50']:7.1f} ms  "
+                f"first token p50 {result['first_token_ms']['p50']:7.1f} ms  "
+                f"turn p50 {result['turn_ms']['p50']:7.1f} ms  session {result['session_bytes'] / 1024:7.1f} KB"
+            )
+
+    import streamlit
+    write_report(
+        "run",
+        {key: value for key, value in vars(args).items() if key != "output"},
+        results,
+        args.output,
+        streamlit=streamlit.__version__,
+        backend={"calls": backend.calls, "injected_errors": backend.errors, "broken_streams": backend.broken_streams},
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Load test of the chat store: many sessions saving and reopening chats at the same time.
+
+Every session writes its messages and context as app.py does and now and then reopens a chat,
+all against one shared ChatStore as in the app, e.g.
+
+    python benchmarks/store_load.py --sessions 1 10 50 200 --turns 20
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from common import ms, percentiles, write_report
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 50, 200], help="sessions at once")
+    parser.add_argument("--turns", type=int, default=20, help="turns per session")
+    parser.add_argument("--reopen-every", type=int, default=5, help="turns between reopening a chat")
+    parser.add_argument("--reply-chars", type=int, default=800, help="characters per reply")
+    parser.add_argument("--output", help="JSON file to write; defaults to benchmarks/results/store_load-<time>.json")
+    return parser.parse_args()
+
+def run_sessions(args, sessions):
+    from chat_engine import ChatStore, new_context_window
+
+    workdir = tempfile.mkdtemp(prefix="bot-benchmark-")
+    path = os.path.join(workdir, "chat_history.db")
+    store = ChatStore(path)
+    seconds = defaultdict(list)
+    errors = []
+    lock = threading.Lock()
+    start = threading.Barrier(sessions)
+    reply = ("Here is a detailed answer. " * (args.reply_chars // 27 + 1))[:args.reply_chars]
+
+    def timed(op, call, *call_args):
+        started_at = time.perf_counter()
+        result = call(*call_args)
+        elapsed = time.perf_counter() - started_at
+        with lock:
+            seconds[op].append(elapsed)
+        return result
+
+    def session():
+        owner = uuid.uuid4().hex
+        start.wait()
+        try:
+            chat_id = timed("create_chat", store.create_chat, owner, "Benchmark chat...")
+            for turn in range(args.turns):
+                prompt = f"Can you help me prepare for job interview number {turn}?"
+                timed("append_message", store.append_message, chat_id, 2 * turn, "user", prompt)
+                timed("append_message", store.append_message, chat_id, 2 * turn + 1, "assistant", reply)
+                timed("save_context", store.save_context, chat_id, {"context_window": new_context_window()})
+                timed("list_chats", store.list_chats, owner)
+                if (turn + 1) % args.reopen_every == 0:
+                    timed("load_context", store.load_context, chat_id)
+                    timed("load_messages", store.load_messages, chat_id)
+        except Exception as e:
+            with lock:
+                errors.append(f"{type(e).__name__}: {e}")
+
+    started_at = time.perf_counter()
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started_at
+
+    ops = sum(len(values) for values in seconds.values())
+    return {
+        "sessions": sessions,
+        "ops": ops,
+        "ops_per_second": ops / wall,
+        "wall_seconds": wall,
+        "errors": errors,
+        "db_bytes": sum(
+            os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix)
+        ),
+        "op_ms": {op: percentiles(ms(values)) for op, values in seconds.items()},
+    }
+
+def main():
+    args = parse_args()
+
+    results = []
+    for sessions in args.sessions:
+        result = run_sessions(args, sessions)
+        results.append(result)
+        slowest = max(result["op_ms"].items(), key=lambda item: item[1]["p95"])
+        print(
+            f"{sessions:>4} sessions  {result['ops_per_second']:8.0f} ops/s  "
+            f"slowest p95 {slowest[0]} {slowest[1]['p95']:.2f} ms  errors {len(result['errors'])}"
+        )
+
+    write_report("store_load", {key: value for key, value in vars(args).items() if key != "output"}, results, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1451 @@
+"""Chat engine of the AI Assistant Bot, independent of the Streamlit UI in app.py."""
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+import os
+import sys
+import time
+import hashlib
+import re
+import functools
+import json
+import sqlite3
+import threading
+import queue
+import random
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from langdetect import detect, DetectorFactory
+from langdetect.detector_factory import init_factory
+from langdetect.lang_detect_exception import LangDetectException
+
+# ---------- Messages ----------
+# Gemini names the assistant side of the conversation "model"
+GEMINI_ROLES = {"user": "user", "assistant": "model"}
+
+def estimate_tokens(text):
+    # Roughly four characters per token, close enough for budgeting
+    return len(text) // 4 + 1
+
+@dataclass(slots=True)
+class Message:
+    """One chat message; slots and an interned role keep it far smaller than a dict."""
+
+    role: str
+    content: str
+    timestamp: float | None = None
+    language: str | None = None
+    tokens: int | None = None
+
+    def __post_init__(self):
+        self.role = sys.intern(self.role)
+        if self.tokens is None:
+            self.tokens = estimate_tokens(self.content)
+
+    def to_gemini(self):
+        return {"role": GEMINI_ROLES.get(self.role, self.role), "parts": [self.content]}
+
+class GeminiHistory(Sequence):
+    """Read-only view of messages[start:stop] in the format start_chat expects, built as it is read."""
+
+    __slots__ = ("_messages", "_start", "_stop", "_prefix")
+
+    def __init__(self, messages, start=0, prefix=(), stop=None):
+        self._messages = messages
+        self._start = start
+        self._stop = len(messages) if stop is None else stop
+        self._prefix = tuple(prefix)
+
+    def __len__(self):
+        return len(self._prefix) + self._stop - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        if index < len(self._prefix):
+            return self._prefix[index]
+        return self._messages[self._start + index - len(self._prefix)].to_gemini()
+
+    def __iter__(self):
+        yield from self._prefix
+        for i in range(self._start, self._stop):
+            yield self._messages[i].to_gemini()
+
+# ---------- Context Window ----------
+# Only the latest turns are sent verbatim; older turns are folded into a short rolling summary
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "6"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000"))
+SUMMARY_MAX_CHARS = 2000
+SUMMARY_SNIPPET_CHARS = 160
+
+# Rolling summary of older turns and how many messages it already covers
+def new_context_window():
+    return {"summary": "", "summarized": 0}
+
+def fold_into_summary(context, messages, upto):
+    lines = [context["summary"]] if context["summary"] else []
+    for m in messages[context["summarized"]:upto]:
+        snippet = " ".join(m.content.split())
+        if len(snippet) > SUMMARY_SNIPPET_CHARS:
+            snippet = snippet[:SUMMARY_SNIPPET_CHARS] + "..."
+        lines.append(f"- {m.role.capitalize()}: {snippet}")
+    summary = "\n".join(lines)
+    if len(summary) > SUMMARY_MAX_CHARS:
+        # Drop the oldest lines so the summary keeps rolling forward
+        summary = summary[-SUMMARY_MAX_CHARS:]
+        summary = summary[summary.find("\n") + 1:]
+    context["summary"] = summary
+    context["summarized"] = upto
+
+def build_context_history(messages, context, reserved_tokens=0, end=None):
+    # Returns the Gemini history of messages[:end] to send and its estimated size in tokens
+    # (including reserved_tokens); the messages are not copied
+    end = len(messages) if end is None else end
+    if context["summarized"] > end:
+        context.update(new_context_window())
+    upto = max(context["summarized"], end - 2 * CONTEXT_RECENT_TURNS)
+    while True:
+        # Start the verbatim window on a user turn so roles keep alternating after the summary
+        while upto < end and messages[upto].role != "user":
+            upto += 1
+        if upto > context["summarized"]:
+            fold_into_summary(context, messages, upto)
+        tokens = reserved_tokens + sum(messages[i].tokens for i in range(upto, end))
+        if context["summary"]:
+            tokens += estimate_tokens(context["summary"])
+        if tokens <= CONTEXT_TOKEN_BUDGET or upto >= end:
+            break
+        upto += 1
+
+    prefix = ()
+    if context["summary"]:
+        prefix = (
+            {"role": "user", "parts": [f"Summary of our earlier conversation:\n{context['summary']}"]},
+            {"role": "model", "parts": ["Got it, I'll keep that in mind."]},
+        )
+    return GeminiHistory(messages, upto, prefix, end), tokens
+
+# ---------- Chat Store ----------
+class ChatStore:
+    """SQLite store of chats and their messages, shared by all sessions."""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS chats (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    owner TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    context TEXT
+                );
+                CREATE INDEX IF NOT EXISTS chats_by_owner ON chats (owner, id);
+                CREATE TABLE IF NOT EXISTS messages (
+                    chat_id INTEGER NOT NULL REFERENCES chats (id),
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (chat_id, seq)
+                );
+            """)
+            self._db.commit()
+
+    def create_chat(self, owner, title):
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO chats (owner, title, created_at) VALUES (?, ?, ?)", (owner, title, time.time())
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def append_message(self, chat_id, seq, role, content):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO messages (chat_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, seq, role, content, time.time()),
+            )
+            self._db.commit()
+
+    def list_chats(self, owner):
+        with self._lock:
+            return self._db.execute("SELECT id, title FROM chats WHERE owner = ? ORDER BY id", (owner,)).fetchall()
+
+    def load_messages(self, chat_id):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT role, content, created_at FROM messages WHERE chat_id = ? ORDER BY seq", (chat_id,)
+            ).fetchall()
+        return [Message(role, content, created_at) for role, content, created_at in rows]
+
+    def save_context(self, chat_id, context):
+        with self._lock:
+            # Lazy histories are written out as plain lists
+            self._db.execute(
+                "UPDATE chats SET context = ? WHERE id = ?", (json.dumps(context, default=list), chat_id)
+            )
+            self._db.commit()
+
+    def load_context(self, chat_id):
+        with self._lock:
+            row = self._db.execute("SELECT context FROM chats WHERE id = ?", (chat_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def delete_chats(self, owner, chat_ids=None):
+        # Deletes the given chats of owner, or all of them
+        with self._lock:
+            if chat_ids is None:
+                chat_ids = [row[0] for row in self._db.execute("SELECT id FROM chats WHERE owner = ?", (owner,))]
+            for chat_id in chat_ids:
+                deleted = self._db.execute("DELETE FROM chats WHERE id = ? AND owner = ?", (chat_id, owner)).rowcount
+                if deleted:
+                    self._db.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            self._db.commit()
+
+# ---------- Language Detection Setup ----------
+DetectorFactory.seed = 0
+
+# langdetect loads its language profiles on first use, which is slow; load them in the
+# background once per process so no request has to wait for it
+langdetect_warmup = {"ready": threading.Event(), "load_seconds": None, "started": False}
+_langdetect_lock = threading.Lock()
+
+def warm_up_langdetect():
+    with _langdetect_lock:
+        if langdetect_warmup["started"]:
+            return langdetect_warmup
+        langdetect_warmup["started"] = True
+
+    def load_profiles():
+        started_at = time.perf_counter()
+        try:
+            init_factory()
+        finally:
+            langdetect_warmup["load_seconds"] = time.perf_counter() - started_at
+            langdetect_warmup["ready"].set()
+
+    threading.Thread(target=load_profiles, name="langdetect-warmup", daemon=True).start()
+    return langdetect_warmup
+
+def detect_with_langdetect(text):
+    # Wait for the warm-up instead of loading the profiles a second time
+    warm_up_langdetect()["ready"].wait()
+    return detect(text)
+
+# Arabic-script and Devanagari text can be told apart from Latin text by its characters alone
+ARABIC_SCRIPT_PATTERN = re.compile("[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]")
+DEVANAGARI_PATTERN = re.compile("[\u0900-\u097F]")
+LATIN_PATTERN = re.compile("[A-Za-z\u00C0-\u024F]")
+# Letters used in Sindhi but not in Urdu (ٻ ڀ ٽ ٿ ٺ ڄ ڃ ڇ ڊ ڌ ڍ ڏ ڙ ڦ ڪ ڱ ڳ ڻ)
+SINDHI_LETTER_PATTERN = re.compile("[\u067A\u067B\u067D\u067F\u0680\u0683\u0684\u0687\u068A\u068C\u068D\u068F\u0699\u06A6\u06AA\u06B1\u06B3\u06BB]")
+
+def detect_script_language(text):
+    # Returns "ur" or "sd" for text written mostly in a non-Latin script, None otherwise
+    latin = len(LATIN_PATTERN.findall(text))
+    arabic = len(ARABIC_SCRIPT_PATTERN.findall(text))
+    if arabic > latin:
+        return "sd" if SINDHI_LETTER_PATTERN.search(text) else "ur"
+    # Hindi is mapped to Urdu, as with langdetect
+    if len(DEVANAGARI_PATTERN.findall(text)) > latin:
+        return "ur"
+    return None
+
+# Expanded keywords for better detection
+roman_urdu_keywords = [
+    'kese', 'mein', 'acha', 'kyun', 'tum', 'kaise', 'kya', 'nahi', 'ho', 'thik', 'hun', 
+    'ap', 'main', 'hai', 'hain', 'kar', 'raha', 'rahi', 'rahe', 'karna', 'karein', 
+    'karo', 'jao', 'aao', 'dena', 'lena', 'batao', 'sunao', 'dikhao', 'samjhao',
+    'theek', 'acha', 'bura', 'mushkil', 'asan', 'koshish', 'mehnat', 'waqt', 'din',
+    'raat', 'subah', 'shaam', 'dopahar', 'hamesha', 'kabhi', 'nahin', 'nahi',
+    'haan', 'jee', 'bilkul', 'zaroor', 'shayad', 'matlab', 'lekin', 'magar',
+    'aur', 'ya', 'per', 'phir', 'dobara', 'kab', 'kaisa', 'kesi', 'kuch'
+]
+
+roman_sindhi_keywords = [
+    'cha', 'hal', 'aa', 'tu', 'budha', 'theek', 'aahiyan', 'qurab', 'mahrabni', 'Shukar', 'Allah',
+    'ahes', 'aahiyan', 'keean', 'kaise', 'mitha', 'thoda', 'ganeyo', 'bhalaa', 'savere',
+    'khalaan', 'budho', 'achho', 'kerao', 'kario', 'deo', 'cho', 'chhe', 'chha', 'tha',
+    'tho', 'sahi', 'kharab', 'mushkil', 'asaan', 'waqt', 'dinh', 'raat', 'subh', 'shaam',
+    'hamesh', 'kadhen', 'naa', 'haa', 'zaroor', 'shayad', 'matlab', 'pan', 'mokalyo',
+    'acho', 'suthaa', 'pyaaro', 'mehrbani', 'khush', 'aaeindah', 'akhir'
+]
+
+# Common phrases that settle the language on their own
+urdu_test_phrases = ['kese ho', 'kaise ho', 'kia hal', 'kia haal', 'ap kese', 'tum kaise', 
+                     'kya kar', 'kya ho', 'kidher', 'kahan', 'kyun', 'main', 'mein',
+                     'theek', 'acha', 'han', 'nahi', 'bilkul']
+sindhi_test_phrases = ['cha hal', 'keean ahes', 'keean aahiyan', 'tha kithay', 'cha',
+                       'thiyo', 'aahiyan', 'pyaro', 'khush', 'achho', 'budho']
+
+WORD_PATTERN = re.compile(r"\w+")
+
+class RomanLanguageDetector:
+    """Token lookup tables for Roman Urdu and Roman Sindhi, built once from the phrase and keyword lists."""
+
+    def __init__(self, urdu_phrases, sindhi_phrases, urdu_keywords, sindhi_keywords):
+        self.urdu_phrases = frozenset(tuple(p.lower().split()) for p in urdu_phrases)
+        self.sindhi_phrases = frozenset(tuple(p.lower().split()) for p in sindhi_phrases)
+        urdu_words = frozenset(w.lower() for w in urdu_keywords)
+        sindhi_words = frozenset(w.lower() for w in sindhi_keywords)
+        # A keyword used by both languages is weaker evidence than one used by only one of them
+        self.keyword_weights = {}
+        for word in urdu_words | sindhi_words:
+            shared = word in urdu_words and word in sindhi_words
+            weight = 0.5 if shared else 1.0
+            self.keyword_weights[word] = (
+                weight if word in urdu_words else 0.0,
+                weight if word in sindhi_words else 0.0,
+            )
+
+    def tokenize(self, text):
+        return WORD_PATTERN.findall(text.lower())
+
+    def match_phrases(self, tokens):
+        # Single words and adjacent word pairs cover every phrase in the lists
+        grams = {(token,) for token in tokens}
+        grams.update(zip(tokens, tokens[1:]))
+        if not grams.isdisjoint(self.urdu_phrases):
+            return "roman_ur"
+        if not grams.isdisjoint(self.sindhi_phrases):
+            return "roman_sd"
+        return None
+
+    def match_keywords(self, tokens, short_message):
+        urdu_score = 0.0
+        sindhi_score = 0.0
+        for token in set(tokens):
+            weights = self.keyword_weights.get(token)
+            if weights:
+                urdu_score += weights[0]
+                sindhi_score += weights[1]
+        threshold = 0.5 if short_message else 2.0
+        # Sindhi wins ties, as it was checked first before scores were weighted
+        if sindhi_score >= threshold and sindhi_score >= urdu_score:
+            return "roman_sd"
+        if urdu_score >= threshold:
+            return "roman_ur"
+        return None
+
+# Results are memoized per normalized message; rules that depend on the session stay in detect_language
+LANGUAGE_CACHE_SIZE = 2048
+
+class MemoizedLanguageDetector:
+    """LRU-memoized detection of the language of a normalized message."""
+
+    def __init__(self, detector, maxsize):
+        self.detector = detector
+        self.phrase_language = functools.lru_cache(maxsize=maxsize)(self._phrase_language)
+        self.content_language = functools.lru_cache(maxsize=maxsize)(self._content_language)
+
+    def _phrase_language(self, normalized):
+        return self.detector.match_phrases(self.detector.tokenize(normalized))
+
+    def _content_language(self, normalized):
+        # Returns None when the language is not one the bot answers in
+        tokens = self.detector.tokenize(normalized)
+        detected_lang = self.detector.match_keywords(tokens, short_message=len(normalized.split()) <= 5)
+        if detected_lang:
+            return detected_lang
+
+        # Urdu and Sindhi script need no statistical detection
+        detected_lang = detect_script_language(normalized)
+        if detected_lang:
+            return detected_lang
+
+        # Use langdetect for other languages
+        try:
+            lang = detect_with_langdetect(normalized)
+        except LangDetectException:
+            return None
+        # Map Hindi to Urdu as they're very similar for this use case
+        if lang == "hi":
+            return "ur"
+        return lang if lang in ["en", "ur", "sd"] else None
+
+    def stats(self):
+        phrase = self.phrase_language.cache_info()
+        content = self.content_language.cache_info()
+        hits = phrase.hits + content.hits
+        misses = phrase.misses + content.misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "size": phrase.currsize + content.currsize,
+        }
+
+def new_language_detector(maxsize=LANGUAGE_CACHE_SIZE):
+    detector = RomanLanguageDetector(urdu_test_phrases, sindhi_test_phrases, roman_urdu_keywords, roman_sindhi_keywords)
+    return MemoizedLanguageDetector(detector, maxsize)
+
+# ---------- Prompt Templates ----------
+# Personality and context for more natural responses
+bot_persona = {
+    "en": """You are a helpful, friendly AI assistant that can help with almost anything the user asks. 
+         You speak in a warm, conversational tone and use natural language with occasional emojis where appropriate. 
+         You're knowledgeable, clear, and concise when providing information, writing code, telling stories, or assisting with various tasks.
+         When responding to questions, provide thoughtful, personalized answers as if chatting with a friend.
+         Avoid robotic responses and respond like a supportive human assistant would.""",
+         
+    "ur": """آپ ایک مددگار، دوستانہ اے آئی اسسٹنٹ ہیں جو تقریباً ہر وہ چیز کر سکتے ہیں جو صارف پوچھے۔
+         آپ گرم جوشی سے بات کرتے ہیں اور قدرتی زبان استعمال کرتے ہیں، مناسب جگہوں پر ایموجیز بھی شامل کرتے ہیں۔
+         آپ معلومات فراہم کرنے، کوڈ لکھنے، کہانیاں سنانے، یا مختلف کاموں میں مدد کرنے میں عالم، واضح اور مختصر ہیں۔
+         سوالات کے جواب دیتے وقت، ایک دوست کی طرح سوچے سمجھے، ذاتی جوابات دیں۔
+         روبوٹ جیسے جوابات سے بچیں اور ایک مددگار انسانی اسسٹنٹ کی طرح جواب دیں۔""",
+         
+    "sd": """توهان هڪ مددگار، دوستاڻو اي آءِ اسسٽنٽ آهيو جيڪو تقريبن هر اها شيء ڪري سگهو ٿا جيڪا صارف پڇي.
+         توهان گرم جوشيءَ سان ڳالهايو ٿا ۽ فطري زبان استعمال ڪريو ٿا، مناسب جاين تي ايموجيز به شامل ڪريو ٿا.
+         توهان معلومات فراهم ڪرڻ، ڪوڊ لکڻ، ڪهاڻيون ٻڌائڻ، يا مختلف ڪمن ۾ مدد ڪرڻ ۾ عالم، واضح ۽ مختصر آهيو.
+         سوالن جا جواب ڏيندي، هڪ دوست جي طرح سوچي سمجهي، ذاتي جواب ڏيو.
+         روبوٽ جهڙن جوابن کان پاسو ڪريو ۽ هڪ مددگار انساني اسسٽنٽ جي طرح جواب ڏيو.""",
+         
+    "roman_ur": """Aap aik helpful, friendly AI assistant hain jo taqreeban har wo cheez kar sakte hain jo user poochay.
+         Aap garm joshi se baat karte hain aur natural language istemal karte hain, emojis bhi appropriate jagah pe use karte hain.
+         Aap information provide karne, code likhne, kahaniyan sunane, ya mukhtalif kamon mein madad karne mein aalim, wazeh aur mukhtasar hain.
+         Sawalaat ke jawab dete waqt, thoughtful aur personalized answers dein, jaise ke aap kisi dost se baat kar rahe hon.
+         Robotic responses se bachein aur aik supportive human assistant ki tarah jawab dein.""",
+         
+    "roman_sd": """Tavheen hik helpful, friendly AI assistant aahyo jeko taqreeban har uha shay kare sagho tho jeka user puche.
+         Tavheen garam joshi saan galhaayo tha aur natural language istemal kayo tha, emojis bi appropriate jayen te use kayo tha.
+         Tavheen information muhaya karan, code likhan, kahaniyon budhayan, ya mukhtalif kaman men madad karan men aalim, wazeh aur mukhtasar aahyo.
+         Sawalan ja jawab dindo waqt, sochyo samjhyo, zati jawab diyo, jayen te tavheen khangi dost saan galhayo tha.
+         Robotic responses khan bacho aur hik madad kanda insani assistant ji tarah jawab diyo."""
+}
+
+# Career context for more relevant responses
+career_context = {
+    "en": """I understand various career challenges and can provide tailored advice for:
+         - Career transitions and job searching
+         - Resume/CV optimization and interview preparation
+         - Skill development and educational decisions
+         - Workplace conflicts and professional growth
+         - Entrepreneurship and freelancing
+         - Work-life balance and burnout prevention""",
+         
+    "ur": """مجھے مختلف کیریئر چیلنجز کا علم ہے اور میں مندرجہ ذیل معاملات میں ڈھالے گئے مشورے دے سکتا ہوں:
+         - کیریئر کی تبدیلی اور نوکری کی تلاش
+         - ریزیومے/سی وی کی اصلاح اور انٹرویو کی تیاری
+         - ہنر کی ترقی اور تعلیمی فیصلے
+         - کام کی جگہ پر تنازعات اور پیشہ ورانہ ترقی
+         - کاروبار اور آزاد پیشہ
+         - کام اور زندگی کا توازن اور تھکاوٹ سے بچاؤ""",
+         
+    "sd": """مون کي مختلف ڪيريئر چئلينجز جي ڄاڻ آهي ۽ آئون هيٺين معاملن ۾ مناسب صلاح ڏئي سگھان ٿو:
+         - ڪيريئر جي تبديلي ۽ نوڪري جي ڳولا
+         - ريزيومي/سي وي جي بهتري ۽ انٽرويو جي تياري
+         - هنر جي ترقي ۽ تعليمي فيصلا
+         - ڪم جي جاءِ تي تنازعن ۽ پيشه وراڻي ترقي
+         - ڪاروبار ۽ آزاد پيشه
+         - ڪم ۽ زندگي جو توازن ۽ ٿڪاوٽ کان بچاءُ""",
+         
+    "roman_ur": """Mujhe mukhtalif career challenges ka ilm hai aur main darj zail mein tailored advice de sakta hun:
+         - Career transitions aur job searching
+         - Resume/CV ki optimization aur interview preparation
+         - Skill development aur educational decisions
+         - Workplace conflicts aur professional growth
+         - Entrepreneurship aur freelancing
+         - Work-life balance aur burnout prevention""",
+         
+    "roman_sd": """Mun khe mukhtalif career challenges ji knowledge ahe aur aan hetheyan case men suitable advice dei saghyan tho:
+         - Career transitions aur job searching
+         - Resume/CV ji optimization aur interview preparation
+         - Skill development aur educational decisions
+         - Workplace conflicts aur professional growth
+         - Entrepreneurship aur freelancing
+         - Work-life balance aur burnout prevention"""
+}
+
+# Conversation style guides for more natural dialogue
+conversation_style = {
+    "en": """I'll keep my responses conversational, friendly, and helpful. I'll use natural language patterns with varied sentence structures and an engaging tone. I might use rhetorical questions, personal anecdotes, or thoughtful pauses where appropriate.""",
+    
+    "ur": """میں اپنے جوابات کو گفتگو کے انداز میں، دوستانہ، اور مددگار رکھوں گا۔ میں قدرتی زبان کے نمونے استعمال کروں گا جس میں مختلف جملوں کی ساخت اور دلچسپ لہجہ ہوگا۔ میں مناسب جگہوں پر بلاغتی سوالات، ذاتی واقعات، یا سوچ بھرے وقفے استعمال کر سکتا ہوں۔""",
+    
+    "sd": """آءُ پنهنجي جوابن کي گفتگوءَ جي انداز ۾، دوستاڻي، ۽ مددگار رکندس. آءُ قدرتي ٻوليءَ جا نمونا استعمال ڪندس جن ۾ مختلف جملن جي ساخت ۽ دلچسپ لهجو هوندو. آءُ مناسب جاين تي بلاغتي سوال، ذاتي واقعا، يا سوچ ڀريل مهلت استعمال ڪري سگھان ٿو.""",
+    
+    "roman_ur": """Main apne jawabat ko guftugu ke andaz mein, dostana, aur helpful rakhun ga. Main natural language patterns use karun ga jis mein mukhtalif jumlon ki sakht aur engaging tone hogi. Main munasib jaghon par balaaghati sawalaat, zaati waqiyaat, ya soch bhare mawaqe istemal kar sakta hun.""",
+    
+    "roman_sd": """Aan panhnje jawaban khe guftugu je andaz men, dostana, aur helpful rakhandus. Aan natural language patterns istemal kandus jin men mukhtalif jumlan ji sakht aur engaging tone hondi. Aan munasib jayen te balaaghati sawal, zati waqia, ya soch bharyal waqfa istemal kare saghyan tho."""
+}
+
+# Combine instructions for a comprehensive but CONCISE prompt
+system_instruction = {
+    "en": f"""You are an AI Assistant Bot that can help with almost anything. Answer CONCISELY with a maximum of 2-3 sentences. Be direct and simple. Use 1-2 emojis maximum. 
+
+DO NOT WRITE LONG PARAGRAPHS. Keep answers short, simple, and to the point.
+
+Even for complex questions, break down your answer into bullet points if needed, but keep the total response brief.""",
+    
+    "ur": f"""آپ ایک ای آئی اسسٹنٹ بوٹ ہیں جو تقریباً ہر چیز میں مدد کر سکتے ہیں۔ مختصر اور سیدھے جواب دیں، زیادہ سے زیادہ 2-3 جملوں میں۔ سادہ اور براہ راست بات کریں۔ زیادہ سے زیادہ 1-2 ایموجی استعمال کریں۔
+
+لمبے پیراگراف نہ لکھیں۔ جوابات مختصر، آسان، اور مقصد تک محدود رکھیں۔
+
+پیچیدہ سوالات کے لیے بھی، اگر ضروری ہو تو اپنے جواب کو بلٹ پوائنٹس میں تقسیم کریں، لیکن مجموعی جواب مختصر رکھیں۔""",
+    
+    "sd": f"""توهان هڪ ائي آئي اسسٽنٽ بوٽ آهيو جيڪو تقريبن هر شيء ۾ مدد ڪري سگهو ٿو۔ مختصر ۽ سڌي جواب ڏيو، وڌيڪ ۾ وڌيڪ 2-3 جملن ۾. سادو ۽ سڌو ڳالهايو. وڌيڪ ۾ وڌيڪ 1-2 ايموجي استعمال ڪريو.
+
+ڏڪا پيراگراف نه لکو۔ جواب مختصر، سادا، ۽ مقصد تائين محدود رکو.
+
+اڋيوڪڻين سوالن لاءَ به، جيڪڏهن ضروري هجي ته پنهنجي جواب کي بليٽ پوائينٽس ۾ ورهايو، پر سموري جواب مختصر رکو.""",
+    
+    "roman_ur": f"""Aap aik AI Assistant Bot hain jo taqreeban har cheez mein madad kar sakte hain. Mukhtasir aur seedhe jawab dein, ziada se ziada 2-3 jumlon mein. Sadah aur baraah rast baat karein. Ziada se ziada 1-2 emojis istemal karein.
+
+Lambe paragraphs na likhein. Jawabaat mukhtasir, aasan, aur maqsad tak mehdood rakhein.
+
+Pechida sawalaat ke liye bhi, agar zaroori ho to apne jawab ko bullet points mein taqseem karein, lekin majmui jawab mukhtasir rakhein.""",
+    
+    "roman_sd": f"""Tavheen hik AI Assistant Bot aahyo jeko taqreeban har shay men madad kare sagho tho. Mukhtasir te sudho jawab diyo, wadheek 2-3 jumlan men. Sadho te sudho galhayo. Wadheek 1-2 emojis istemal kayo.
+
+Dhaga paragraphs na likho. Jawab mukhtasir, asaan, te maqsad taaen mehdood rakho.
+
+Pechida sawalan lae bi, jeker zaroori huje ta panhjo jawab bullet points men warrhayo, par samuro jawab mukhtasir rakho."""
+}
+
+def render_system_instruction(instruction, language):
+    return f"{instruction}\n\nKeep your response very concise, direct, and short, responding in {language} language. Remember that you can help with almost anything including writing code, stories, and providing various types of information."
+
+# Optional JSON file overriding templates, e.g. {"system_instruction": {"en": "..."}}
+PROMPTS_FILE = os.getenv("PROMPTS_FILE")
+
+# Templates are loaded and the per-language instructions rendered once per engine
+def load_prompt_registry(path=None):
+    templates = {
+        "bot_persona": bot_persona,
+        "career_context": career_context,
+        "conversation_style": conversation_style,
+        "system_instruction": system_instruction,
+    }
+    if path:
+        with open(path, encoding="utf-8") as f:
+            overrides = json.load(f)
+        templates = {name: {**texts, **overrides.get(name, {})} for name, texts in templates.items()}
+    return {
+        "templates": templates,
+        "system_instructions": {
+            language: render_system_instruction(instruction, language)
+            for language, instruction in templates["system_instruction"].items()
+        },
+    }
+
+def build_system_instruction(registry, language):
+    # The instruction is given to the model once per chat instead of being prepended to every message
+    rendered = registry["system_instructions"].get(language)
+    if rendered is None:
+        rendered = render_system_instruction(registry["templates"]["system_instruction"]["en"], language)
+    return rendered
+
+# ---------- Response Cache ----------
+# Opt-in cache for replies to the first message of a chat, which do not depend on earlier context
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH")  # Optional SQLite file to keep entries across restarts
+
+class ResponseCache:
+    """LRU cache of replies with a time-to-live, optionally backed by a SQLite file."""
+
+    def __init__(self, max_entries, ttl, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (stored_at, text)
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, stored_at REAL, text TEXT)")
+            self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                entry = self._db.execute("SELECT stored_at, text FROM responses WHERE key = ?", (key,)).fetchone()
+                if entry is not None:
+                    self._store(key, tuple(entry))
+            if entry is None or now - entry[0] > self.ttl:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, text):
+        entry = (time.time(), text)
+        with self._lock:
+            self._store(key, entry)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO responses (key, stored_at, text) VALUES (?, ?, ?)", (key, *entry))
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._entries)}
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+
+# ---------- Rate Limiter ----------
+# All sessions share one API key, so calls are admitted through a process-wide gate: a token
+# bucket keeps the request rate under the quota and a cap on calls in flight keeps bursts in
+# check. Callers wait in a first-come, first-served line instead of hitting quota errors.
+GEMINI_RATE_PER_MINUTE = float(os.getenv("GEMINI_RATE_PER_MINUTE", "60"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "10"))
+GEMINI_MAX_CONCURRENT = int(os.getenv("GEMINI_MAX_CONCURRENT", "4"))
+GEMINI_QUEUE_TIMEOUT = float(os.getenv("GEMINI_QUEUE_TIMEOUT", "300"))  # Longest wait in line, in seconds
+
+class GeminiGate:
+    """Token bucket plus concurrency limit with a FIFO line of waiting callers."""
+
+    def __init__(self, rate_per_minute, burst, max_concurrent):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.admitted = 0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._in_flight = 0
+        self._line = deque()  # tickets of waiting callers, first come first
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def join(self):
+        ticket = object()
+        with self._cond:
+            self._line.append(ticket)
+        return ticket
+
+    def position(self, ticket):
+        # 1 means next in line
+        with self._cond:
+            return self._line.index(ticket) + 1 if ticket in self._line else 0
+
+    def acquire(self, ticket, timeout):
+        # Waits up to timeout for the ticket to reach the front with a token and a free slot
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._refill()
+                if self._line[0] is ticket and self._tokens >= 1 and self._in_flight < self.max_concurrent:
+                    self._line.popleft()
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    self.admitted += 1
+                    # The next caller may be able to go as well
+                    self._cond.notify_all()
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                # Wake up when the next token is due, or earlier when a call finishes
+                wait = remaining if self._tokens >= 1 else min(remaining, (1 - self._tokens) / self.rate)
+                self._cond.wait(wait)
+
+    def leave(self, ticket):
+        with self._cond:
+            if ticket in self._line:
+                self._line.remove(ticket)
+                self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {"in_flight": self._in_flight, "waiting": len(self._line), "admitted": self.admitted}
+
+# ---------- Request Executor ----------
+# Gemini calls run on a shared worker pool so the calling thread can enforce a deadline, retry
+# transient failures and give up on a reply the user stopped
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))  # Seconds per reply, retries included
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_BACKOFF_BASE = 1.0
+GEMINI_BACKOFF_MAX = 16.0
+GEMINI_WORKERS = int(os.getenv("GEMINI_WORKERS", "16"))
+WAIT_POLL_SECONDS = 0.25
+
+# Quota (429) and server-side (5xx) errors are worth another attempt; anything else is not
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+)
+
+class ReplyTimeout(Exception):
+    """Gemini did not finish the reply before the deadline."""
+
+class ReplyCancelled(Exception):
+    """The caller cancelled the reply before it was finished."""
+
+def backoff_delay(attempt):
+    # Exponential backoff with full jitter, so sessions that failed together do not retry together
+    return random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt))
+
+def produce_chunks(send, deadline, cancel, chunks, gate):
+    # Runs on a worker thread and hands the text chunks over to the script thread; the gate
+    # slot is held until the call is really over, even if the script stopped waiting for it
+    try:
+        for text in send(max(deadline - time.monotonic(), 0.0)):
+            if cancel.is_set():
+                chunks.put(("cancelled", None))
+                return
+            chunks.put(("chunk", text))
+        chunks.put(("done", None))
+    except Exception as e:
+        chunks.put(("error", e))
+    finally:
+        gate.release()
+
+def wait_for_slot(gate, show, cancel):
+    # Returns the seconds spent waiting in line
+    ticket = gate.join()
+    waited_from = time.monotonic()
+    admitted = False
+    try:
+        while not gate.acquire(ticket, WAIT_POLL_SECONDS):
+            if cancel.is_set():
+                raise ReplyCancelled("Cancelled while waiting in line")
+            if time.monotonic() - waited_from > GEMINI_QUEUE_TIMEOUT:
+                raise ReplyTimeout("Still waiting in line for Gemini")
+            show(f"Many people are chatting right now. You are number {gate.position(ticket)} in line...")
+        admitted = True
+    finally:
+        if not admitted:
+            gate.leave(ticket)
+    return time.monotonic() - waited_from
+
+def stream_reply(send, cancel, gate, executor, timeout=GEMINI_TIMEOUT, on_wait=None, stats=None):
+    """Yield the text chunks of one reply.
+
+    send(timeout) makes the Gemini call and yields its text; it runs on the worker pool once
+    the gate admits it and is retried on transient errors until the deadline, as long as
+    nothing has been yielded yet. Time spent waiting in line does not count towards the
+    deadline. on_wait(status) is called while waiting so the caller can show progress.
+    Setting cancel raises ReplyCancelled right away and makes the worker stop at its next
+    chunk. If given, stats gets the time
+    spent in line ("queue_wait") and the number of retries ("retries").
+    """
+    stats = stats if stats is not None else {}
+    stats.update(queue_wait=0.0, retries=0)
+    deadline = None
+    attempt = 0
+    yielded = False
+    shown = None
+
+    def show(status):
+        nonlocal shown
+        if on_wait is not None and status != shown:
+            shown = status
+            on_wait(status)
+
+    while True:
+        waited = wait_for_slot(gate, show, cancel)
+        stats["queue_wait"] += waited
+        deadline = time.monotonic() + timeout if deadline is None else deadline + waited
+        chunks = queue.Queue()
+        try:
+            executor.submit(produce_chunks, send, deadline, cancel, chunks, gate)
+        except BaseException:
+            gate.release()
+            raise
+        started_at = time.monotonic()
+        while True:
+            if cancel.is_set():
+                raise ReplyCancelled("Reply cancelled")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                cancel.set()
+                raise ReplyTimeout(f"No reply within {timeout:.0f} seconds")
+            try:
+                kind, value = chunks.get(timeout=min(remaining, WAIT_POLL_SECONDS))
+            except queue.Empty:
+                waited = time.monotonic() - started_at
+                if waited >= 1 and not yielded:
+                    show(f"Waiting for a reply... {waited:.0f}s")
+                continue
+            if kind == "chunk":
+                yielded = True
+                yield value
+            elif kind == "done":
+                return
+            elif kind == "cancelled":
+                raise ReplyCancelled("Reply cancelled")
+            else:
+                break
+
+        # Part of the reply is already shown, so only a failure before the first chunk is retried
+        delay = backoff_delay(attempt)
+        if yielded or not isinstance(value, RETRYABLE_ERRORS) or attempt >= GEMINI_MAX_RETRIES \
+                or time.monotonic() + delay >= deadline:
+            raise value
+        attempt += 1
+        stats["retries"] = attempt
+        retry_at = time.monotonic() + delay
+        while time.monotonic() < retry_at:
+            if cancel.is_set():
+                raise ReplyCancelled("Reply cancelled")
+            show(f"Gemini is busy, retrying in {retry_at - time.monotonic():.0f}s "
+                 f"(attempt {attempt + 1} of {GEMINI_MAX_RETRIES + 1})...")
+            time.sleep(min(WAIT_POLL_SECONDS, max(retry_at - time.monotonic(), 0)))
+
+# ---------- Single Flight ----------
+# Identical requests in flight at the same time (a double submit from two tabs, or many users
+# asking the same first question) share one Gemini call: the first caller makes it and the
+# others replay its chunks as they arrive.
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT", "1").lower() not in ("0", "false", "no")
+
+class ReplyStopped(Exception):
+    """The caller whose Gemini call was shared stopped it after part of the reply was sent."""
+
+def history_fingerprint(history):
+    digest = hashlib.sha256()
+    for entry in history:
+        digest.update(entry["role"].encode("utf-8"))
+        for part in entry["parts"]:
+            digest.update(b"\x00" + str(part).encode("utf-8"))
+        digest.update(b"\x01")
+    return digest.hexdigest()
+
+class Flight:
+    """Chunks of one shared reply, kept until the reply ends so late joiners get all of it."""
+
+    __slots__ = ("chunks", "done", "error", "followers", "_cond")
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self._cond = threading.Condition()
+
+    def publish(self, text):
+        with self._cond:
+            self.chunks.append(text)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def replay(self, cancel, on_wait=None):
+        """Yield the chunks of the reply as they are published; raise its error if it failed."""
+        sent = 0
+        shown = None
+        started_at = time.monotonic()
+        while True:
+            if cancel.is_set():
+                raise ReplyCancelled("Reply cancelled")
+            with self._cond:
+                if sent == len(self.chunks) and not self.done:
+                    self._cond.wait(WAIT_POLL_SECONDS)
+                new_chunks = self.chunks[sent:]
+                done, error = self.done, self.error
+            for text in new_chunks:
+                yield text
+            sent += len(new_chunks)
+            if done and sent == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+            waited = time.monotonic() - started_at
+            status = f"Waiting for a reply... {waited:.0f}s"
+            if on_wait is not None and not sent and waited >= 1 and status != shown:
+                shown = status
+                on_wait(status)
+
+class SingleFlight:
+    """Process-wide table of the requests in flight, by request key."""
+
+    def __init__(self):
+        self.leaders = 0
+        self.saved = 0  # Gemini calls avoided by joining a flight
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        # Returns the flight and whether the caller leads it, i.e. makes the call
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.saved += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            self.leaders += 1
+            return flight, True
+
+    def land(self, key, flight, error=None):
+        # Called by the leader once its call has ended; later requests start a new flight
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(error)
+
+    def fall_back(self):
+        # A follower had to make its own call after all
+        with self._lock:
+            self.saved -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.leaders, "saved": self.saved, "in_flight": len(self._flights)}
+
+# Shared by every engine in the process
+single_flight = SingleFlight()
+
+# ---------- Metrics ----------
+# Off by default. When on, every stage of a turn is timed and kept per process and per
+# session, and each turn is logged as one JSON line. When off, spans are a shared no-op.
+METRICS_ENABLED = os.getenv("METRICS", "").lower() in ("1", "true", "yes")
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1024"))  # Latest samples used for percentiles
+METRICS_FILE = os.getenv("METRICS_FILE")  # Prometheus text file, e.g. for node_exporter's textfile collector
+METRICS_FILE_INTERVAL = 5.0  # Seconds between rewrites of the file
+METRICS_LOG = os.getenv("METRICS_LOG")  # File for the JSON turn log, "-" for stderr
+METRICS_PREFIX = "chatbot"
+QUANTILES = (0.5, 0.95, 0.99)
+
+metrics_logger = logging.getLogger("chat_engine.metrics")
+
+class Summary:
+    """Count and sum of all observations, plus the latest ones for percentiles."""
+
+    __slots__ = ("count", "total", "samples")
+
+    def __init__(self, window):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def quantiles(self):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: None for q in QUANTILES}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+class Metrics:
+    """Stage timings, counters and gauges, for one session or the whole process."""
+
+    enabled = True
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self._timings = {}  # stage -> Summary of seconds
+        self._counters = {}  # (name, labels) -> value
+        self._gauges = {}  # name -> latest value
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            summary = self._timings.get(stage)
+            if summary is None:
+                summary = self._timings[stage] = Summary(self.window)
+            summary.observe(seconds)
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def snapshot(self):
+        with self._lock:
+            timings = {
+                stage: {"count": summary.count, "sum": summary.total, **{f"p{round(q * 100)}": v for q, v in summary.quantiles().items()}}
+                for stage, summary in self._timings.items()
+            }
+            counters = {
+                name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else ""): value
+                for (name, labels), value in self._counters.items()
+            }
+            gauges = dict(self._gauges)
+        return {"timings": timings, "counters": counters, "gauges": gauges}
+
+    def prometheus(self):
+        # Text exposition format: stage timings as one summary, counters as they are named
+        lines = [f"# TYPE {METRICS_PREFIX}_stage_seconds summary"]
+        with self._lock:
+            for stage, summary in sorted(self._timings.items()):
+                for q, value in summary.quantiles().items():
+                    if value is not None:
+                        lines.append(f'{METRICS_PREFIX}_stage_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+                lines.append(f'{METRICS_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {summary.total:.6f}')
+                lines.append(f'{METRICS_PREFIX}_stage_seconds_count{{stage="{stage}"}} {summary.count}')
+            typed = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {METRICS_PREFIX}_{name} counter")
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{METRICS_PREFIX}_{name}{{{label_text}}} {value}" if labels else f"{METRICS_PREFIX}_{name} {value}")
+            for name, value in sorted(self._gauges.items()):
+                lines.append(f"# TYPE {METRICS_PREFIX}_{name} gauge")
+                lines.append(f"{METRICS_PREFIX}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # Written to a temporary file first so a scraper never reads half a file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+class NullMetrics:
+    """Stands in for Metrics when they are off; every call does nothing."""
+
+    enabled = False
+
+    def observe(self, stage, seconds):
+        pass
+
+    def count(self, name, value=1, **labels):
+        pass
+
+    def gauge(self, name, value):
+        pass
+
+    def snapshot(self):
+        return {"timings": {}, "counters": {}, "gauges": {}}
+
+NULL_METRICS = NullMetrics()
+
+class Span:
+    """Times a block of code into one or more Metrics."""
+
+    __slots__ = ("stage", "targets", "started_at")
+
+    def __init__(self, stage, targets):
+        self.stage = stage
+        self.targets = targets
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started_at
+        for target in self.targets:
+            target.observe(self.stage, elapsed)
+        return False
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_SPAN = NullSpan()
+
+def new_metrics():
+    return Metrics() if METRICS_ENABLED else NULL_METRICS
+
+# Shared by every engine in the process; each conversation can keep its own as well
+process_metrics = new_metrics()
+
+def configure_metrics_log(path=METRICS_LOG):
+    # One JSON object per line, without the usual log prefixes
+    if not path or metrics_logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr) if path == "-" else logging.FileHandler(path, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    metrics_logger.addHandler(handler)
+    metrics_logger.setLevel(logging.INFO)
+    metrics_logger.propagate = False
+
+# ---------- Chat Engine ----------
+GEMINI_MODEL_NAME = 'gemini-1.5-pro-latest'
+GENERATION_CONFIG = None  # None keeps Gemini's default generation settings
+
+class Conversation:
+    """One chat: its messages, rolling context window and reply language.
+
+    It holds no Gemini chat session; every call starts one from the turn's trimmed history.
+    """
+
+    def __init__(self, messages=None, context=None, on_message=None):
+        self.messages = messages if messages is not None else []
+        self.context = context or new_context_window()
+        self.language = "en"
+        self.language_preference = None  # Always reply in this language when set
+        # Called with every new message, e.g. to save it
+        self.on_message = on_message
+        # Timings and counters of this conversation only, on top of the process-wide ones
+        self.metrics = NULL_METRICS
+
+    def add_message(self, role, content, language=None):
+        message = Message(role, content, time.time(), language)
+        self.messages.append(message)
+        if self.on_message is not None:
+            self.on_message(message)
+        return message
+
+    def history(self):
+        # The trimmed Gemini history, as saved with the chat
+        return build_context_history(self.messages, self.context)[0]
+
+@dataclass
+class Turn:
+    """One prompt and its reply, with what it took to produce it."""
+
+    prompt: str
+    language: str = "en"
+    output: str = ""
+    cached: bool = False
+    streamed: bool = True
+    context_tokens: int = 0
+    history: object = None
+    cache_key: str | None = None
+    shared: bool = False  # Replayed from an identical request's Gemini call
+    response: object = None
+    metrics: dict = field(default_factory=dict)
+
+class ChatEngine:
+    """Answers messages of any number of conversations, without any UI.
+
+    It detects the reply language, builds the system instruction and the trimmed history,
+    and calls Gemini through the shared cache, rate limiter and worker pool. The app drives
+    it turn by turn to draw the reply as it streams; other callers can use respond() or
+    respond_async().
+    """
+
+    def __init__(self, model_name=GEMINI_MODEL_NAME, generation_config=GENERATION_CONFIG, prompts=None,
+                 response_cache=None, gate=None, executor=None, timeout=GEMINI_TIMEOUT, metrics=None, flights=None):
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.prompts = prompts if prompts is not None else load_prompt_registry(PROMPTS_FILE)
+        self.detector = new_language_detector()
+        self.response_cache = response_cache
+        self.gate = gate or GeminiGate(GEMINI_RATE_PER_MINUTE, GEMINI_BURST, GEMINI_MAX_CONCURRENT)
+        self.executor = executor or ThreadPoolExecutor(max_workers=GEMINI_WORKERS, thread_name_prefix="gemini")
+        self.timeout = timeout
+        self.flights = flights if flights is not None else single_flight if SINGLE_FLIGHT_ENABLED else None
+        self.metrics = metrics if metrics is not None else process_metrics
+        self._metrics_written_at = 0.0
+        configure_metrics_log()
+        # Models are shared by all conversations, one per system instruction; each call starts its own session
+        self._models = {}
+        self._models_lock = threading.Lock()
+        warm_up_langdetect()
+
+    def system_instruction(self, language):
+        return build_system_instruction(self.prompts, language)
+
+    def metric_targets(self, conversation=None):
+        if not self.metrics.enabled:
+            return ()
+        if conversation is None or not conversation.metrics.enabled:
+            return (self.metrics,)
+        return (self.metrics, conversation.metrics)
+
+    def span(self, stage, conversation=None):
+        """Time a block as one stage, for the process and for the conversation."""
+        targets = self.metric_targets(conversation)
+        return Span(stage, targets) if targets else NULL_SPAN
+
+    def record_turn(self, conversation, turn, error=None):
+        # Counters, the JSON log line and the metrics file, once per finished or failed turn
+        targets = self.metric_targets(conversation)
+        if not targets:
+            return
+        usage = getattr(turn.response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None) or 0
+        reply_tokens = getattr(usage, "candidates_token_count", None) or 0
+        for target in targets:
+            target.count("turns_total")
+            target.count("retries_total", turn.metrics.get("retries", 0))
+            target.count("context_tokens_total", turn.context_tokens)
+            target.count("prompt_tokens_total", prompt_tokens)
+            target.count("reply_tokens_total", reply_tokens)
+            if turn.cached:
+                target.count("cache_hits_total")
+            elif turn.cache_key is not None:
+                target.count("cache_misses_total")
+            if turn.shared:
+                target.count("coalesced_total")
+            if error is not None:
+                target.count("errors_total", error=type(error).__name__)
+        self.update_gauges()
+
+        if metrics_logger.handlers:
+            metrics_logger.info(json.dumps({
+                "time": round(time.time(), 3),
+                "language": turn.language,
+                "cached": turn.cached,
+                "shared": turn.shared,
+                "streamed": turn.streamed,
+                "error": type(error).__name__ if error is not None else None,
+                "context_tokens": turn.context_tokens,
+                "prompt_tokens": prompt_tokens,
+                "reply_tokens": reply_tokens,
+                **{key: round(value, 6) if isinstance(value, float) else value for key, value in turn.metrics.items()},
+            }, ensure_ascii=False))
+
+        now = time.monotonic()
+        if METRICS_FILE and now - self._metrics_written_at >= METRICS_FILE_INTERVAL:
+            self._metrics_written_at = now
+            try:
+                self.metrics.write_prometheus(METRICS_FILE)
+            except OSError as e:
+                metrics_logger.warning(f"Could not write {METRICS_FILE}: {e}")
+
+    def update_gauges(self):
+        # State of the process rather than of a turn, so only kept in the process metrics
+        if langdetect_warmup["load_seconds"] is not None:
+            self.metrics.gauge("langdetect_load_seconds", round(langdetect_warmup["load_seconds"], 6))
+        for key, value in self.detector.stats().items():
+            self.metrics.gauge(f"language_cache_{key}", round(value, 6))
+        if self.response_cache is not None:
+            for key, value in self.response_cache.stats().items():
+                self.metrics.gauge(f"response_cache_{key}", value)
+
+    def model(self, language):
+        instruction = self.system_instruction(language)
+        with self._models_lock:
+            model = self._models.get(instruction)
+            if model is None:
+                model = genai.GenerativeModel(
+                    self.model_name, system_instruction=instruction, generation_config=self.generation_config
+                )
+                self._models[instruction] = model
+            return model
+
+    def detect_language(self, conversation, text):
+        # If user has specified a language preference, always use that
+        if conversation.language_preference:
+            return conversation.language_preference
+
+        normalized = " ".join(text.lower().split())
+
+        # Special case handling for common phrases
+        detected_lang = self.detector.phrase_language(normalized)
+        if detected_lang:
+            conversation.language = detected_lang
+            return detected_lang
+
+        # If there's a conversation and the message is short, maintain the previous language
+        if conversation.messages and len(normalized.split()) <= 3:
+            return conversation.language
+
+        # Keywords, script and langdetect
+        detected_lang = self.detector.content_language(normalized)
+        if detected_lang:
+            conversation.language = detected_lang
+            return detected_lang
+
+        # Default to English or previous language
+        if conversation.language and conversation.language != "en":
+            return conversation.language
+        return "en"
+
+    def cache_key(self, prompt, language):
+        # Case, spacing and trailing punctuation do not change the question being asked
+        normalized = " ".join(prompt.lower().split()).strip("?!.")
+        raw = f"{self.model_name}\n{language}\n{self.system_instruction(language)}\n{normalized}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def flight_key(self, turn):
+        # Identical prompt, language, model and history; the history is what makes a reply differ
+        # between conversations, so it is part of the key and not only the prompt
+        key = turn.cache_key or self.cache_key(turn.prompt, turn.language)
+        return f"{key}:{history_fingerprint(turn.history)}:{self.generation_config!r}"
+
+    def begin_turn(self, conversation, prompt, stream=True):
+        """Add the prompt to the conversation and get everything ready to send it."""
+        turn = Turn(prompt, streamed=stream)
+        message = conversation.add_message("user", prompt)
+
+        started_at = time.perf_counter()
+        turn.language = self.detect_language(conversation, prompt)
+        turn.metrics["language_detection"] = time.perf_counter() - started_at
+        for target in self.metric_targets(conversation):
+            target.observe("language_detection", turn.metrics["language_detection"])
+        conversation.language = turn.language
+        message.language = turn.language
+
+        # Reuse a cached reply when this is the first message of the chat
+        if self.response_cache is not None and len(conversation.messages) == 1:
+            with self.span("cache_lookup", conversation):
+                turn.cache_key = self.cache_key(prompt, turn.language)
+                cached_output = self.response_cache.get(turn.cache_key)
+            if cached_output is not None:
+                turn.output = cached_output
+                turn.cached = True
+
+        # Send a bounded window of the conversation; the new prompt itself is sent separately
+        with self.span("prompt_assembly", conversation):
+            turn.history, turn.context_tokens = build_context_history(
+                conversation.messages,
+                conversation.context,
+                reserved_tokens=estimate_tokens(self.system_instruction(turn.language)) + estimate_tokens(prompt),
+                end=len(conversation.messages) - 1,
+            )
+        return turn
+
+    def stream_turn(self, conversation, turn, cancel=None, on_wait=None):
+        """Yield the reply text as it arrives; turn.output holds all of it so far."""
+        cancel = cancel or threading.Event()
+        model = self.model(turn.language)
+        stats = {}
+        error = None
+        started_at = time.perf_counter()
+        try:
+            if turn.cached:
+                turn.metrics["first_chunk"] = time.perf_counter() - started_at
+                yield turn.output
+                return
+
+            def send(timeout):
+                # Every attempt gets its own session started from the same history, so a failed
+                # attempt, or one still running after its caller gave up, cannot touch the next one
+                chat = model.start_chat(history=turn.history)
+                options = {"timeout": max(timeout, 1.0)}
+                if turn.streamed:
+                    turn.response = chat.send_message(turn.prompt, stream=True, request_options=options)
+                    for chunk in turn.response:
+                        yield chunk.text
+                else:
+                    turn.response = chat.send_message(turn.prompt, request_options=options)
+                    yield turn.response.text
+
+            def call():
+                return stream_reply(send, cancel, self.gate, self.executor, self.timeout, on_wait, stats)
+
+            def chunks():
+                if self.flights is None:
+                    yield from call()
+                    return
+                key = self.flight_key(turn)
+                flight, leading = self.flights.join(key)
+                if leading:
+                    yield from self.lead_flight(key, flight, call())
+                    return
+                turn.shared = True
+                try:
+                    yield from flight.replay(cancel, on_wait)
+                except ReplyStopped:
+                    # The caller making the call stopped it; make our own unless part of the reply is shown
+                    if turn.output:
+                        raise
+                    turn.shared = False
+                    self.flights.fall_back()
+                    yield from call()
+
+            for text in chunks():
+                if "first_chunk" not in turn.metrics:
+                    turn.metrics["first_chunk"] = time.perf_counter() - started_at
+                turn.output += text
+                yield text
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            cancel.set()
+            turn.metrics["total"] = time.perf_counter() - started_at
+            turn.metrics.update(stats)
+            for target in self.metric_targets(conversation):
+                for stage, key in (("queue_wait", "queue_wait"), ("first_token", "first_chunk"), ("gemini_reply", "total")):
+                    if key in turn.metrics:
+                        target.observe(stage, turn.metrics[key])
+            # A finished turn is recorded by finish_turn, once its reply is added
+            if error is not None:
+                self.record_turn(conversation, turn, error)
+
+    def lead_flight(self, key, flight, chunks):
+        # Passes the chunks of this caller's Gemini call on to the callers sharing it
+        error = ReplyStopped("The shared reply was stopped")
+        try:
+            for text in chunks:
+                flight.publish(text)
+                yield text
+            error = None
+        except ReplyCancelled:
+            # Only this caller gave up; the others make their own call
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.flights.land(key, flight, error)
+
+    def finish_turn(self, conversation, turn):
+        """Add the reply to the conversation; returns the turn's timings and token counts."""
+        conversation.add_message("assistant", turn.output, turn.language)
+        if turn.cache_key is not None and not turn.cached and not turn.shared:
+            self.response_cache.put(turn.cache_key, turn.output)
+        usage = getattr(turn.response, "usage_metadata", None)
+        turn.metrics.update({
+            "streamed": turn.streamed,
+            "cached": turn.cached,
+            "shared": turn.shared,
+            "context_tokens": turn.context_tokens,
+            "prompt_tokens": getattr(usage, "prompt_token_count", None),
+        })
+        self.record_turn(conversation, turn)
+        return turn.metrics
+
+    def respond(self, conversation, prompt, stream=False, cancel=None):
+        """Answer prompt in conversation and return the finished Turn."""
+        turn = self.begin_turn(conversation, prompt, stream)
+        for _ in self.stream_turn(conversation, turn, cancel):
+            pass
+        self.finish_turn(conversation, turn)
+        return turn
+
+    async def respond_async(self, conversation, prompt, stream=False):
+        # The blocking call runs on a thread; cancelling the task makes it raise ReplyCancelled right away
+        cancel = threading.Event()
+        try:
+            return await asyncio.to_thread(self.respond, conversation, prompt, stream, cancel)
+        finally:
+            cancel.set()
@@ -0,0 +1,41 @@
+import os
+import sys
+import warnings
+
+import google.generativeai as genai
+import pytest
+import streamlit as st
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# google.generativeai warns on import that it is deprecated
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+# The limiter is read when chat_engine is imported; the fake has no quota to protect
+os.environ.setdefault("GEMINI_RATE_PER_MINUTE", "1000000")
+os.environ.setdefault("GEMINI_BURST", "1000000")
+os.environ.setdefault("GEMINI_MAX_CONCURRENT", "1000")
+
+from fake_gemini import FakeBackend, install  # noqa: E402
+
+APP_PATH = os.path.join(ROOT, "app.py")
+
+@pytest.fixture
+def backend(monkeypatch):
+    """A fake Gemini backend with no latency, installed in place of the real one for the test."""
+    monkeypatch.setattr(genai, "GenerativeModel", genai.GenerativeModel)
+    monkeypatch.setattr(genai, "configure", genai.configure)
+    fake = FakeBackend(first_chunk_latency=0.0, chunk_delay=0.0, chunks=4)
+    install(fake)
+    return fake
+
+@pytest.fixture
+def app_env(tmp_path, monkeypatch):
+    """Environment for running app.py in AppTest: a fake key and a fresh chat store."""
+    monkeypatch.setenv("GEMINI_API_KEY", "fake-test-key")
+    monkeypatch.setenv("CHAT_DB_PATH", str(tmp_path / "chat_history.db"))
+    # Engines and their models are cached per process; each test gets its own
+    st.cache_resource.clear()
+    return tmp_path
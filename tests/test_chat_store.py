@@ -0,0 +1,66 @@
+"""The shared chat store under many sessions at once: no lost writes, and owners only see their own chats."""
+
+import threading
+import uuid
+
+from streamlit.testing.v1 import AppTest
+
+from chat_engine import ChatStore
+from conftest import APP_PATH
+
+def test_concurrent_sessions_keep_every_message(tmp_path):
+    store = ChatStore(str(tmp_path / "chat_history.db"))
+    sessions = 40
+    turns = 10
+    start = threading.Barrier(sessions)
+    chats = {}
+    errors = []
+
+    def session():
+        owner = uuid.uuid4().hex
+        start.wait()
+        try:
+            chat_id = store.create_chat(owner, "Load test...")
+            for seq in range(2 * turns):
+                store.append_message(chat_id, seq, "user" if seq % 2 == 0 else "assistant", f"{owner} {seq}")
+                store.save_context(chat_id, {"history": [seq]})
+                store.list_chats(owner)
+            chats[owner] = chat_id
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(chats) == sessions
+    for owner, chat_id in chats.items():
+        assert store.list_chats(owner) == [(chat_id, "Load test...")]
+        assert [m.content for m in store.load_messages(chat_id)] == [f"{owner} {seq}" for seq in range(2 * turns)]
+        assert store.load_context(chat_id) == {"history": [2 * turns - 1]}
+
+def test_delete_only_touches_the_owners_chats(tmp_path):
+    store = ChatStore(str(tmp_path / "chat_history.db"))
+    mine = store.create_chat("me", "Mine")
+    theirs = store.create_chat("them", "Theirs")
+    store.append_message(mine, 0, "user", "hello")
+    store.append_message(theirs, 0, "user", "hi")
+
+    store.delete_chats("me", [theirs])
+    assert store.list_chats("them") == [(theirs, "Theirs")]
+
+    store.delete_chats("me")
+    assert store.list_chats("me") == []
+    assert store.load_messages(mine) == []
+    assert [m.content for m in store.load_messages(theirs)] == ["hi"]
+
+def test_chat_key_is_not_taken_from_the_url(backend, app_env):
+    key = uuid.uuid4().hex
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.query_params["sid"] = key
+    at.run()
+    assert not at.exception
+    assert at.session_state.owner_id != key
@@ -0,0 +1,62 @@
+"""The chat handler adds no fixed delay of its own on top of Gemini's reply time."""
+
+import statistics
+import time
+
+from streamlit.testing.v1 import AppTest
+
+from conftest import APP_PATH
+
+PROMPTS = [
+    "Can you help me prepare for a job interview?",
+    "What skills should I learn to become a data scientist?",
+    "How do I write a good cover letter for a software job?",
+    "Give me three tips to avoid burnout at work.",
+]
+
+def rerun_seconds(at, runs=len(PROMPTS)):
+    seconds = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        at.run()
+        seconds.append(time.perf_counter() - started_at)
+        assert not at.exception
+    return statistics.median(seconds)
+
+def turn_seconds(at, prompts):
+    """Median wall time of a turn, and of the engine's first_chunk and total, over the prompts."""
+    seconds = []
+    for prompt in prompts:
+        started_at = time.perf_counter()
+        at.chat_input[0].set_value(prompt).run()
+        seconds.append(time.perf_counter() - started_at)
+        assert not at.exception
+    metrics = at.session_state.turn_metrics[-len(prompts):]
+    return (
+        statistics.median(seconds),
+        statistics.median(m["first_chunk"] for m in metrics),
+        statistics.median(m["total"] for m in metrics),
+    )
+
+def test_handler_adds_no_delay(backend, app_env):
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.run()
+    turn_seconds(at, ["Hello, how are you doing today?"])  # Loads language profiles and models
+
+    # Everything is measured against runs on this machine rather than fixed limits
+    rerun = rerun_seconds(at)
+    instant_wall, instant_first, instant_total = turn_seconds(at, PROMPTS)
+
+    # The typing indicator used to sleep 0.4 s before every call; with an instant backend the
+    # app's share of a turn is now a few reruns' worth of drawing
+    instant_app = instant_wall - instant_total
+    assert instant_app < 3 * rerun
+
+    # With a slow backend the engine's timings are the backend's latency plus the same overhead
+    latency = backend.first_chunk_latency = 0.5
+    slow_wall, slow_first, slow_total = turn_seconds(at, PROMPTS)
+    assert slow_first - latency < instant_first + latency / 10
+    assert slow_total - latency < instant_total + latency / 10
+
+    # and the app's share of the turn does not grow with it
+    assert slow_wall - slow_total < 2 * instant_app
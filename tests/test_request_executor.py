@@ -0,0 +1,144 @@
+"""The Gemini call path (deadline, retries and cancellation) against fake clients, offline."""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import chat_engine
+from chat_engine import ChatEngine, Conversation, GeminiGate, ReplyCancelled, ReplyTimeout, stream_reply
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(chat_engine, "GEMINI_BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(chat_engine, "GEMINI_BACKOFF_MAX", 0.02)
+
+@pytest.fixture
+def gate():
+    return GeminiGate(1_000_000, 1_000_000, 100)
+
+@pytest.fixture
+def executor():
+    pool = ThreadPoolExecutor(max_workers=4)
+    yield pool
+    pool.shutdown(wait=False, cancel_futures=True)
+
+class ScriptedSend:
+    """send(timeout) that runs one scripted step per call: an error to raise or chunks to yield."""
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.calls = 0
+
+    def __call__(self, timeout):
+        step = self.steps[min(self.calls, len(self.steps) - 1)]
+        self.calls += 1
+        for item in step:
+            if isinstance(item, Exception):
+                raise item
+            if isinstance(item, float):
+                time.sleep(item)
+                continue
+            yield item
+
+def collect(send, gate, executor, timeout=5.0, cancel=None, stats=None):
+    return list(stream_reply(send, cancel or threading.Event(), gate, executor, timeout, stats=stats))
+
+@pytest.mark.parametrize("error", [google_exceptions.TooManyRequests, google_exceptions.ServiceUnavailable])
+def test_retries_transient_errors(error, gate, executor):
+    send = ScriptedSend([error("busy")], [error("busy")], ["Hello ", "there"])
+    stats = {}
+    assert collect(send, gate, executor, stats=stats) == ["Hello ", "there"]
+    assert send.calls == 3
+    assert stats["retries"] == 2
+
+def test_gives_up_after_max_retries(gate, executor):
+    send = ScriptedSend([google_exceptions.ServiceUnavailable("busy")])
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        collect(send, gate, executor)
+    assert send.calls == chat_engine.GEMINI_MAX_RETRIES + 1
+
+def test_does_not_retry_other_errors(gate, executor):
+    send = ScriptedSend([google_exceptions.InvalidArgument("bad request")], ["never sent"])
+    with pytest.raises(google_exceptions.InvalidArgument):
+        collect(send, gate, executor)
+    assert send.calls == 1
+
+def test_does_not_retry_after_first_chunk(gate, executor):
+    send = ScriptedSend(["Hello ", google_exceptions.ServiceUnavailable("broken stream")], ["Hello again"])
+    received = []
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        for text in stream_reply(send, threading.Event(), gate, executor, 5.0):
+            received.append(text)
+    assert received == ["Hello "]
+    assert send.calls == 1
+
+def test_deadline(gate, executor):
+    send = ScriptedSend([2.0, "too late"])
+    started_at = time.monotonic()
+    with pytest.raises(ReplyTimeout):
+        collect(send, gate, executor, timeout=0.3)
+    assert time.monotonic() - started_at < 1.0
+
+def test_cancel_before_first_chunk(gate, executor):
+    send = ScriptedSend([2.0, "too late"])
+    cancel = threading.Event()
+    threading.Timer(0.2, cancel.set).start()
+    started_at = time.monotonic()
+    with pytest.raises(ReplyCancelled):
+        collect(send, gate, executor, cancel=cancel)
+    assert time.monotonic() - started_at < 1.0
+
+def test_cancel_mid_reply(gate, executor):
+    send = ScriptedSend(["Hello ", 2.0, "there"])
+    cancel = threading.Event()
+    received = []
+    with pytest.raises(ReplyCancelled):
+        for text in stream_reply(send, cancel, gate, executor, 5.0):
+            received.append(text)
+            cancel.set()
+    assert received == ["Hello "]
+
+def test_gate_slot_is_released(gate, executor):
+    send = ScriptedSend([google_exceptions.InvalidArgument("bad request")])
+    with pytest.raises(google_exceptions.InvalidArgument):
+        collect(send, gate, executor)
+    time.sleep(0.05)
+    assert gate.stats()["in_flight"] == 0
+
+def test_engine_retries_and_recovers(backend):
+    backend.error_rate = 1.0
+    engine = ChatEngine()
+    conversation = Conversation()
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        engine.respond(conversation, "Can you help me prepare for a job interview?")
+    assert backend.calls == chat_engine.GEMINI_MAX_RETRIES + 1
+
+    backend.error_rate = 0.0
+    turn = engine.respond(conversation, "What skills should I learn to become a data scientist?")
+    assert turn.output.startswith("This is a fake")
+
+def test_engine_recovers_from_broken_stream(backend):
+    # A stream that fails partway breaks the SDK's chat history; the next turn must not care
+    backend.stream_error_rate = 1.0
+    engine = ChatEngine()
+    conversation = Conversation()
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        engine.respond(conversation, "Can you help me prepare for a job interview?", stream=True)
+    assert backend.calls == 1
+
+    backend.stream_error_rate = 0.0
+    turn = engine.respond(conversation, "What skills should I learn to become a data scientist?", stream=True)
+    assert turn.output.startswith("This is a fake")
+
+def test_engine_cancel(backend):
+    backend.first_chunk_latency = 2.0
+    engine = ChatEngine()
+    cancel = threading.Event()
+    threading.Timer(0.2, cancel.set).start()
+    started_at = time.monotonic()
+    with pytest.raises(ReplyCancelled):
+        engine.respond(Conversation(), "Give me three tips to avoid burnout at work.", cancel=cancel)
+    assert time.monotonic() - started_at < 1.0
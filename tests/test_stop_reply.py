@@ -0,0 +1,64 @@
+"""The Stop button cancels a reply that is still streaming."""
+
+import threading
+import time
+
+from streamlit.runtime.scriptrunner_utils.script_requests import RerunData
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.element_tree import parse_tree_from_messages
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+from conftest import APP_PATH
+
+def test_stop_cancels_a_streaming_reply(backend, app_env, monkeypatch):
+    runners = []
+    init = LocalScriptRunner.__init__
+
+    def keep_runner(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        runners.append(self)
+
+    monkeypatch.setattr(LocalScriptRunner, "__init__", keep_runner)
+    backend.chunks = 40
+    backend.chunk_delay = 0.05
+    sent = []
+    clicked = threading.Event()
+
+    def click_stop(i):
+        # Clicks Stop a few chunks in, as the browser would: with the button's new state and the
+        # fragment it was drawn in, if any
+        sent.append(i)
+        if i != 3 or clicked.is_set():
+            return
+        runner = runners[-1]
+        messages = list(runner.forward_msgs())
+        tree = parse_tree_from_messages(messages)
+        tree._runner = at  # Widget states are read through the app's session state
+        stop = tree.button(key="stop_reply")
+        stop.click()
+        fragment_id = next(
+            m.delta.fragment_id for m in messages
+            if m.WhichOneof("type") == "delta" and m.delta.new_element.button.id == stop.id
+        )
+        runner.request_rerun(RerunData(widget_states=tree.get_widget_states(), fragment_id=fragment_id or None))
+        clicked.set()
+
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.run()
+    backend.on_chunk = click_stop
+    at.chat_input[0].set_value("Can you help me prepare for a job interview?").run()
+
+    assert clicked.is_set()
+    assert not at.exception
+    # The click interrupted the run that was streaming, which cancelled the request
+    assert len(sent) < backend.chunks
+    deadline = time.monotonic() + 5
+    while backend.in_flight and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert backend.in_flight == 0
+    reply = at.session_state.conversation.messages[-1]
+    assert reply.role == "assistant"
+    assert reply.content.startswith("This is ")
+    assert reply.content.endswith("⏹ Reply stopped.")
+    assert "partial_reply" not in at.session_state
+    assert not at.session_state.processing_message
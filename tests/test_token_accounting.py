@@ -0,0 +1,69 @@
+"""History size per turn, before and after the system instruction moved out of the user turns."""
+
+from chat_engine import (
+    CONTEXT_TOKEN_BUDGET, ChatEngine, Conversation, build_context_history, estimate_tokens, new_context_window,
+)
+
+PROMPTS = [
+    "Can you help me prepare for a job interview?",
+    "What skills should I learn to become a data scientist?",
+    "How do I write a good cover letter for a software job?",
+    "Give me three tips to avoid burnout at work.",
+]
+
+def old_prompt_tokens(instruction, prompts, replies):
+    # Each turn used to send the instruction plus a reminder with the user text, and the chat
+    # history kept every one of those prompts
+    reminder = "Remember to reply in the same language as the user."
+    sent = []
+    history = 0
+    for prompt, reply in zip(prompts, replies):
+        final_prompt = estimate_tokens(f"{instruction}\n\n{prompt}\n\n{reminder}")
+        sent.append(history + final_prompt)
+        history += final_prompt + estimate_tokens(reply)
+    return sent
+
+def test_instruction_is_sent_once_per_turn(backend):
+    engine = ChatEngine()
+    conversation = Conversation()
+    instruction = engine.system_instruction("en")
+    prompts = [PROMPTS[i % len(PROMPTS)] + f" ({i + 1})" for i in range(8)]
+
+    turns = [engine.respond(conversation, prompt) for prompt in prompts]
+    new = [turn.metrics["prompt_tokens"] for turn in turns]
+    old = old_prompt_tokens(instruction, prompts, [turn.output for turn in turns])
+
+    for turn in turns:
+        assert all(instruction not in part for entry in turn.history for part in entry["parts"])
+    # The history now grows by the prompt and reply only; it used to grow by the instruction too
+    instruction_tokens = estimate_tokens(instruction)
+    for i in range(1, len(turns)):
+        assert new[i] - new[i - 1] < instruction_tokens
+        assert old[i] - old[i - 1] > instruction_tokens
+        assert new[i] < old[i]
+    assert old[-1] - new[-1] > (len(turns) - 1) * instruction_tokens
+
+def test_history_stays_within_budget(backend):
+    engine = ChatEngine()
+    conversation = Conversation()
+    long_prompt = "Please explain this in detail. " * 200
+    sizes = []
+    for i in range(30):
+        turn = engine.begin_turn(conversation, f"{long_prompt} ({i})")
+        sizes.append(turn.context_tokens)
+        conversation.add_message("assistant", "Here is a long answer. " * 200, turn.language)
+    assert max(sizes) <= CONTEXT_TOKEN_BUDGET
+    # Without trimming the history would have grown with every turn
+    assert sum(m.tokens for m in conversation.messages) > 2 * CONTEXT_TOKEN_BUDGET
+
+def test_history_is_a_view_of_the_messages():
+    conversation = Conversation()
+    for i in range(10):
+        conversation.add_message("user", f"question {i}")
+        conversation.add_message("assistant", f"answer {i}")
+    conversation.add_message("user", "question 10")
+    history, _ = build_context_history(conversation.messages, new_context_window(), end=len(conversation.messages) - 1)
+    # The turn reads the conversation's own list instead of a copy of it
+    assert history._messages is conversation.messages
+    assert len(list(history)) == len(history)
+    assert list(history)[-1] == {"role": "model", "parts": ["answer 9"]}